@@ -0,0 +1,29 @@
+from django.urls import include, path
+
+from . import async_views
+
+# чтение рецептов, тэгов и ингредиентов - в пуле потоков,
+# остальные адреса - как в api.urls. Только числовой pk: иначе
+# recipes/<pk>/ перехватит recipes/favorite/ и recipes/shopping_cart/
+urlpatterns = [
+    path('tags/', async_views.tag_list, name='tags-list'),
+    path('tags/<int:pk>/', async_views.tag_detail, name='tags-detail'),
+    path(
+        'ingredients/', async_views.ingredient_list, name='ingredients-list'
+    ),
+    path(
+        'ingredients/<int:pk>/',
+        async_views.ingredient_detail,
+        name='ingredients-detail'
+    ),
+    path('recipes/', async_views.recipe_list, name='recipes-list'),
+    path(
+        'recipes/download_shopping_cart/',
+        async_views.download_shopping_cart,
+        name='recipes-download-shopping-cart'
+    ),
+    path(
+        'recipes/<int:pk>/', async_views.recipe_detail, name='recipes-detail'
+    ),
+    path('', include('api.urls')),
+]
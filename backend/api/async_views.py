@@ -0,0 +1,72 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from core.middleware import profiled_connections
+
+from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+
+
+def run_in_thread(view):
+    """Асинхронная обертка синхронного представления DRF для ASGI.
+
+    В Django 3.2 нет асинхронного ORM, а синхронные представления под
+    ASGI выполняются по очереди в одном потоке. Обертка выполняет
+    представление целиком в пуле потоков, параллельно с другими
+    запросами, со своим соединением с БД.
+    """
+    def call(request, *args, **kwargs):
+        close_old_connections()
+        try:
+            # профиль запроса учитывает запросы к БД этого потока
+            with profiled_connections():
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render'):
+                    response.render()
+                elif response.streaming:
+                    # ASGI обработчик читает поток в цикле событий, где
+                    # обращения к БД запрещены, читаем его здесь
+                    response.streaming_content = list(
+                        response.streaming_content
+                    )
+            return response
+        finally:
+            close_old_connections()
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        return await sync_to_async(call, thread_sensitive=False)(
+            request, *args, **kwargs
+        )
+
+    return async_view
+
+
+def viewset_view(viewset, basename, actions, detail):
+    # как DefaultRouter: basename, detail и параметры @action
+    initkwargs = {'basename': basename, 'detail': detail}
+    for action in actions.values():
+        initkwargs.update(getattr(getattr(viewset, action), 'kwargs', {}))
+    return run_in_thread(viewset.as_view(actions, **initkwargs))
+
+
+tag_list = viewset_view(TagViewSet, 'tags', {'get': 'list'}, False)
+tag_detail = viewset_view(TagViewSet, 'tags', {'get': 'retrieve'}, True)
+ingredient_list = viewset_view(
+    IngredientViewSet, 'ingredients', {'get': 'list'}, False
+)
+ingredient_detail = viewset_view(
+    IngredientViewSet, 'ingredients', {'get': 'retrieve'}, True
+)
+recipe_list = viewset_view(
+    RecipeViewSet, 'recipes', {'get': 'list', 'post': 'create'}, False
+)
+recipe_detail = viewset_view(
+    RecipeViewSet, 'recipes',
+    {'get': 'retrieve', 'patch': 'partial_update', 'delete': 'destroy'},
+    True
+)
+download_shopping_cart = viewset_view(
+    RecipeViewSet, 'recipes', {'get': 'download_shopping_cart'}, False
+)
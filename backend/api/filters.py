@@ -1,8 +1,54 @@
 import django_filters
+from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filter
 from rest_framework.filters import SearchFilter
 
-from foods.models import Ingredient, Recipe
+from core.cache import get_version
+from foods.autocomplete import ingredient_index
+from foods.models import Ingredient, Recipe, RecipeTag, Tag
+from foods.search import search_recipes
+
+
+def get_tag_ids(slugs):
+    """id тэгов по slug из кэша, сбрасывается при изменении тэгов."""
+    key = f'tags:{get_version("tags")}:slug_ids'
+    slug_ids = cache.get(key)
+    if slug_ids is None:
+        slug_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, slug_ids)
+    return [slug_ids[slug] for slug in slugs if slug in slug_ids]
+
+
+class MultipleValueField(forms.Field):
+    """Список значений параметра: ?tags=a&tags=b."""
+    widget = forms.SelectMultiple
+
+    def to_python(self, value):
+        if not value:
+            return []
+        return [str(item) for item in value]
+
+
+class TagSlugFilter(filter.Filter):
+    """Рецепты, у которых есть хотя бы один из тэгов.
+
+    Подзапрос EXISTS по связке рецепт - тэг не размножает строки рецептов
+    и не требует DISTINCT.
+    """
+    field_class = MultipleValueField
+
+    def filter(self, queryset, value):
+        if not value:
+            return queryset
+        return queryset.filter(
+            Exists(RecipeTag.objects.filter(
+                recipe=OuterRef('pk'),
+                tag_id__in=get_tag_ids(value)
+            ))
+        )
 
 
 class IngredientFilter(SearchFilter):
@@ -13,6 +59,20 @@ class IngredientFilter(SearchFilter):
         model = Ingredient
         fields = ('name',)
 
+    def filter_queryset(self, request, queryset, view):
+        name = request.query_params.get(self.search_param, '').strip()
+        if not name:
+            return queryset
+        if getattr(view, 'action', None) != 'list':
+            # индекс отдает список, для retrieve нужен queryset
+            return queryset.filter(pk__in=[
+                ingredient.pk for ingredient in ingredient_index.search(name)
+            ])
+        # поиск по началу названия отвечаем из индекса в памяти
+        return ingredient_index.search(
+            name, settings.INGREDIENT_SEARCH_LIMIT
+        )
+
 
 class RecipeFilter(django_filters.FilterSet):
     """Фильтрация для рецептов."""
@@ -21,7 +81,8 @@ class RecipeFilter(django_filters.FilterSet):
     is_in_shopping_cart = filter.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
-    tags = filter.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = TagSlugFilter()
+    search = filter.CharFilter(method='get_search')
 
     class Meta:
         model = Recipe
@@ -30,6 +91,7 @@ class RecipeFilter(django_filters.FilterSet):
             'author',
             'is_in_shopping_cart',
             'tags',
+            'search',
         )
 
     def get_is_favorited(self, queryset, name, value):
@@ -41,3 +103,9 @@ class RecipeFilter(django_filters.FilterSet):
         if value:
             return queryset.filter(shoplists__user_id=self.request.user.pk)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        value = value.strip()
+        if value:
+            return search_recipes(queryset, value)
+        return queryset
@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.utils.cache import parse_etags, patch_cache_control, quote_etag
+from django.utils.http import urlencode
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.cache import digest, get_or_build, get_version
+
+
+class VersionedCacheMixin:
+    """Кэширование ответов list/retrieve по версии данных.
+
+    Версия меняется сигналами при изменении модели, по ней строятся ETag
+    и ключ кэша, поэтому If-None-Match с актуальной версией получает 304
+    без обращения к таблицам.
+    """
+    cache_namespace = None
+
+    def cached_response(self, request, build):
+        version = get_version(self.cache_namespace)
+        path_digest = digest(request.get_full_path())
+        etag = quote_etag(f'{self.cache_namespace}-{version}-{path_digest}')
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = f'{self.cache_namespace}:{version}:{path_digest}'
+            response = Response(get_or_build(key, lambda: build().data))
+
+        response['ETag'] = etag
+        patch_cache_control(
+            response, public=True, max_age=settings.REFERENCE_CACHE_MAX_AGE
+        )
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(VersionedCacheMixin, self).list(
+                request, *args, **kwargs
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(VersionedCacheMixin, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+
+class AnonymousListCacheMixin:
+    """Кэширование списка для анонимных пользователей.
+
+    Ответ анонимному пользователю зависит только от параметров запроса,
+    ключ - нормализованные параметры и версия данных cache_namespace.
+    """
+    cache_namespace = None
+
+    def list_cache_key(self, request):
+        params = urlencode(sorted(
+            (name, sorted(values))
+            for name, values in request.query_params.lists()
+        ), doseq=True)
+        # ссылки next/previous в ответе содержат адрес сервера
+        location = f'{request.scheme}://{request.get_host()}?{params}'
+        version = get_version(self.cache_namespace)
+        return f'{self.cache_namespace}:{version}:list:{digest(location)}'
+
+    def list(self, request, *args, **kwargs):
+        parent = super(AnonymousListCacheMixin, self)
+        if request.user.is_authenticated:
+            return parent.list(request, *args, **kwargs)
+        return Response(get_or_build(
+            self.list_cache_key(request),
+            lambda: parent.list(request, *args, **kwargs).data
+        ))
@@ -1,18 +1,32 @@
-import base64
+from collections import defaultdict
 
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 
-from core.constants import FIELD_LENGTH
+from core import images
+from core.constants import BATCH_RECIPES, FIELD_LENGTH
+from foods import fragments, shoplist
 from foods.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                          ShopList, Tag)
+                          RecipeTag, Tag)
 from users.serializers import UserSerializers
 
 User = get_user_model()
 
 
+def set_prefetched(instance, name, objects):
+    """Связанные объекты из памяти в кэш prefetch_related, как после
+    выборки с prefetch_related(name)."""
+    queryset = getattr(instance, name).model.objects.all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[name] = queryset
+
+
 class TagSerializer(serializers.ModelSerializer):
     """Сериализатор тэга."""
     class Meta:
@@ -93,6 +107,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = serializers.ReadOnlyField(source='image.url')
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -105,10 +120,14 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'thumbnails',
             'text',
             'cooking_time',
         )
 
+    def get_thumbnails(self, obj):
+        return images.variant_urls(obj.image)
+
     def is_authenticated(self):
         return bool(
             self.context
@@ -116,29 +135,152 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
 
     def get_is_favorited(self, obj):
+        # значение уже посчитано в RecipeViewSet.get_queryset
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return bool(self.is_authenticated()
                     and obj.favorites.filter(
                     user=self.context['request'].user.id).exists()
                     )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return bool(self.is_authenticated()
                     and obj.shoplists.filter(
                     user=self.context['request'].user.id).exists()
                     )
 
 
+class RecipeRowListSerializer(serializers.ListSerializer):
+    """Список рецептов: связанные данные загружаются для всей страницы."""
+
+    def to_representation(self, data):
+        return self.child.represent(list(data))
+
+
+class RecipeRowSerializer(serializers.BaseSerializer):
+    """Быстрое отображение рецептов только для чтения.
+
+    Строит тот же ответ, что RecipeSerializer, из строк values() с
+    флагами текущего пользователя (RecipeViewSet.get_queryset). Общая
+    для всех пользователей часть рецепта берется из кэша фрагментов,
+    флаги пользователя накладываются поверх нее.
+    """
+    ROW_FIELDS = (
+        'id',
+        'author_id',
+        'is_favorited',
+        'is_in_shopping_cart',
+        'author_is_subscribed',
+        # ключ курсора RecipeKeysetPagination
+        'pub_date',
+        'name',
+    )
+
+    class Meta:
+        list_serializer_class = RecipeRowListSerializer
+
+    def to_representation(self, row):
+        return self.represent([row])[0]
+
+    @classmethod
+    def represent(cls, rows):
+        if not rows:
+            return []
+        fragments_by_id = fragments.get_fragments(rows, cls.build)
+        data = []
+        for row in rows:
+            fragment = fragments_by_id.get(row['id'])
+            if fragment is None:
+                continue
+            # порядок ключей задан фрагментом
+            data.append({
+                **fragment,
+                'author': {
+                    **fragment['author'],
+                    'is_subscribed': row['author_is_subscribed'],
+                },
+                'is_favorited': row['is_favorited'],
+                'is_in_shopping_cart': row['is_in_shopping_cart'],
+            })
+        return data
+
+    @staticmethod
+    def build(ids):
+        """Общие части ответа для рецептов ids: по одному запросу на
+        рецепты, тэги, ингредиенты и авторов."""
+        tags = defaultdict(list)
+        for recipe_id, *tag in RecipeTag.objects.filter(
+            recipe_id__in=ids
+        ).order_by('tag__name').values_list(
+            'recipe_id', 'tag_id', 'tag__name', 'tag__color', 'tag__slug'
+        ):
+            tags[recipe_id].append(dict(zip(TagSerializer.Meta.fields, tag)))
+
+        # порядок как при prefetch_related: RecipeIngredient.Meta.ordering
+        ingredients = defaultdict(list)
+        for recipe_id, *ingredient in RecipeIngredient.objects.filter(
+            recipe_id__in=ids
+        ).values_list(
+            'recipe_id',
+            'ingredient_id',
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            'amount',
+        ):
+            ingredients[recipe_id].append(
+                dict(zip(RecipeIngredientSerializer.Meta.fields, ingredient))
+            )
+
+        recipes = list(Recipe.objects.filter(pk__in=ids).order_by().values(
+            'id', 'author_id', 'name', 'image', 'text', 'cooking_time'
+        ))
+        authors = {
+            author[1]: author for author in User.objects.filter(
+                pk__in={recipe['author_id'] for recipe in recipes}
+            ).values_list('email', 'id', 'username', 'first_name',
+                          'last_name')
+        }
+
+        author_fields = UserSerializers.Meta.fields
+        return {
+            recipe['id']: {
+                'id': recipe['id'],
+                'tags': tags[recipe['id']],
+                'author': dict(zip(
+                    author_fields, (*authors[recipe['author_id']], False)
+                )),
+                'ingredients': ingredients[recipe['id']],
+                'is_favorited': False,
+                'is_in_shopping_cart': False,
+                'name': recipe['name'],
+                'image': default_storage.url(recipe['image']),
+                'thumbnails': images.variant_urls(recipe['image']),
+                'text': recipe['text'],
+                'cooking_time': recipe['cooking_time'],
+            }
+            for recipe in recipes
+        }
+
+
 class RecipeShortSerializer(serializers.ModelSerializer):
     """Укороченный сериализатор для рецепта."""
+    thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
         fields = (
             'id',
             'name',
             'image',
+            'thumbnails',
             'cooking_time',
         )
 
+    def get_thumbnails(self, obj):
+        return images.variant_urls(obj.image)
+
 
 class Base64ImageField(serializers.ImageField):
     """Поля для изображения."""
@@ -146,7 +288,11 @@ class Base64ImageField(serializers.ImageField):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            try:
+                data = images.decode_base64(imgstr, 'temp.' + ext)
+                images.check_dimensions(data)
+            except images.ImageError as err:
+                raise serializers.ValidationError(str(err))
 
         return super().to_internal_value(data)
 
@@ -181,6 +327,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             'cooking_time',
         )
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
@@ -189,11 +336,19 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             author=self.context.get('request').user,
             **validated_data
         )
-
-        RecipeCreateSerializer.save_tag_ingredient(recipe, tags, ingredients)
+        # новый рецепт еще никто не добавил, на себя подписаться нельзя
+        recipe.is_favorited = recipe.is_in_shopping_cart = False
+        recipe.author.is_subscribed = False
+        set_prefetched(recipe, 'rec_ingrs', [])
+        set_prefetched(recipe, 'tags', [])
+
+        self.related = RecipeCreateSerializer.save_tag_ingredient(
+            recipe, tags, ingredients
+        )
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
@@ -206,25 +361,69 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             instance.cooking_time
         )
 
-        RecipeCreateSerializer.save_tag_ingredient(instance, tags, ingredients)
+        self.related = RecipeCreateSerializer.save_tag_ingredient(
+            instance, tags, ingredients
+        )
 
         return super().update(instance, validated_data)
 
     @staticmethod
     def save_tag_ingredient(instance, tags, ingredients):
-        # удалим старые данные, актуально только для обновления, но для
-        # создания ничего страшного
-        instance.ingredients.clear()
-
-        RecipeIngredient.objects.bulk_create(
-            [RecipeIngredient(
-                recipe=instance,
-                ingredient=ingredient['ingredient'],
-                amount=ingredient['amount']
-            ) for ingredient in ingredients]
-        )
-
-        instance.tags.set(tags)
+        """Изменение состава и тэгов по разнице с текущими.
+
+        Удаляются только убранные строки, количество меняется одним
+        bulk_update, добавляются только новые. Возвращает итоговые
+        связанные объекты для ответа без повторной выборки.
+        """
+        # при обновлении строки уже загружены в RecipeViewSet.get_queryset
+        current = {
+            row.ingredient_id: row for row in instance.rec_ingrs.all()
+        }
+        kept = []
+        changed = []
+        added = []
+        for item in ingredients:
+            row = current.pop(item['ingredient'].id, None)
+            if row is None:
+                row = RecipeIngredient(
+                    recipe=instance,
+                    ingredient=item['ingredient'],
+                    amount=item['amount']
+                )
+                added.append(row)
+                continue
+            if row.amount != item['amount']:
+                row.amount = item['amount']
+                changed.append(row)
+            kept.append(row)
+
+        # итоги списков покупок пересчитываем один раз после всех изменений
+        with shoplist.recipes_update():
+            if current:
+                RecipeIngredient.objects.filter(
+                    pk__in=[row.pk for row in current.values()]
+                ).delete()
+            if changed:
+                RecipeIngredient.objects.bulk_update(changed, ('amount',))
+            if added:
+                RecipeIngredient.objects.bulk_create(added)
+            if current or changed or added:
+                shoplist.recipes_changed([instance.id])
+
+        current_tags = {tag.id: tag for tag in instance.tags.all()}
+        new_tags = [tag for tag in tags if tag.id not in current_tags]
+        removed_tags = set(current_tags) - {tag.id for tag in tags}
+        if removed_tags:
+            instance.tags.remove(*removed_tags)
+        if new_tags:
+            instance.tags.add(*new_tags)
+
+        # порядок как при выборке: сохраненные строки, затем новые
+        kept.sort(key=lambda row: row.pk)
+        return {
+            'rec_ingrs': kept + added,
+            'tags': sorted(tags, key=lambda tag: tag.name),
+        }
 
     def validate(self, attrs):
         tags = attrs.get('tags')
@@ -257,55 +456,24 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         return attrs
 
     def to_representation(self, instance):
+        # UpdateModelMixin сбрасывает кэш prefetch после сохранения,
+        # связи после изменения уже известны
+        for name, objects in getattr(self, 'related', {}).items():
+            set_prefetched(instance, name, objects)
         return RecipeSerializer(
             instance,
             context={'request': self.context.get('request')}
         ).data
 
 
-class FavoriteCreateSerializer(serializers.ModelSerializer):
-    """Сериализатор создания фаворитов."""
-    class Meta:
-        fields = (
-            'user',
-            'recipe',
-        )
-        model = Favorite
-        validators = [
-            UniqueTogetherValidator(
-                queryset=Favorite.objects.all(),
-                fields=('user', 'recipe'),
-                message='Рецепт уже находится в избранном'
-            )
-        ]
-
-    def validate(self, attrs):
-        if attrs['user'].id == attrs['recipe'].author.id:
-            raise serializers.ValidationError(
-                {'following': 'Недопустимо добавить свой рецепт в избранное'}
-            )
-
-        return attrs
-
-    def to_representation(self, instance):
-        return RecipeShortSerializer(instance.recipe).data
-
-
-class ShopListCreateSerializer(serializers.ModelSerializer):
-    """Сериализатор списка покупок."""
-    class Meta:
-        fields = (
-            'user',
-            'recipe',
-        )
-        model = ShopList
-        validators = [
-            UniqueTogetherValidator(
-                queryset=ShopList.objects.all(),
-                fields=('user', 'recipe'),
-                message='Рецепт уже находится в избранном'
-            )
-        ]
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетных операций."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_RECIPES
+    )
 
-    def to_representation(self, instance):
-        return RecipeShortSerializer(instance.recipe).data
+    def validate_recipes(self, value):
+        # повторы убираем с сохранением порядка
+        return list(dict.fromkeys(value))
@@ -0,0 +1,1144 @@
+import base64
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models.signals import post_delete
+from django.test import (AsyncClient, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core import images
+from core.authentication import (REVOKED, CachedTokenAuthentication,
+                                 token_cache_key)
+from core.cache import bump_version
+from core.middleware import ReplicaMiddleware, slowest
+from core.renderers import ORJSONRenderer
+from core.routers import use_replica
+from core.test_runner import REPLICA_ALIAS as REPLICA
+from foods import shoplist
+from foods.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                          ShopList, ShopListIngredient, Tag)
+from users.models import Follow, User
+from .serializers import RecipeRowSerializer, RecipeSerializer
+from .views import RecipeViewSet
+
+# количество рецептов (и авторов) во втором замере
+MANY = 10
+# количество параллельных запросов на добавление
+PARALLEL = 8
+
+
+class QueryCountTest(TestCase):
+    """Количество запросов к БД не зависит от количества рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@foodgram.ru',
+            first_name='Читатель', last_name='Рецептов'
+        )
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тэг {i}', color='#E26C2D', slug=f'tag{i}'
+            )
+            for i in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Продукт {i}', measurement_unit='г'
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.authors = 0
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_recipes(self, count):
+        """Рецепты новых авторов: в избранном, в покупках и в подписках."""
+        for _ in range(count):
+            self.authors += 1
+            author = User.objects.create(
+                username=f'author{self.authors}',
+                email=f'author{self.authors}@foodgram.ru',
+                first_name='Автор', last_name='Рецептов'
+            )
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {self.authors}',
+                image='recipes/recipe.jpg', text='Описание', cooking_time=10
+            )
+            recipe.tags.set(self.tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=amount
+                )
+                for amount, ingredient in enumerate(self.ingredients, 1)
+            )
+            Favorite.objects.create(user=self.user, recipe=recipe)
+            ShopList.objects.create(user=self.user, recipe=recipe)
+            Follow.objects.create(user=self.user, following=author)
+        return recipe
+
+    def get(self, client, url):
+        # без кэша ответов, фрагментов и токенов - худший случай
+        cache.clear()
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def assertConstantQueries(self, url, client=None):
+        client = client or self.client
+        self.add_recipes(1)
+        with CaptureQueriesContext(connection) as queries:
+            self.get(client, url)
+        self.add_recipes(MANY - 1)
+        with self.assertNumQueries(len(queries)):
+            self.get(client, url)
+
+    def test_recipe_list(self):
+        self.assertConstantQueries('/api/recipes/?limit=20')
+
+    def test_recipe_list_anonymous(self):
+        self.assertConstantQueries('/api/recipes/?limit=20', APIClient())
+
+    def test_recipe_detail(self):
+        recipe = self.add_recipes(1)
+        with CaptureQueriesContext(connection) as queries:
+            self.get(self.client, f'/api/recipes/{recipe.pk}/')
+        self.add_recipes(MANY - 1)
+        with self.assertNumQueries(len(queries)):
+            response = self.get(self.client, f'/api/recipes/{recipe.pk}/')
+        self.assertTrue(response.json()['is_favorited'])
+
+    def test_add_link(self):
+        recipe = self.add_recipes(1)
+        Favorite.objects.filter(recipe=recipe).delete()
+        # точка сохранения, INSERT ... RETURNING, счетчик, без блокировки
+        # пользователя; без CTE (SQLite) рецепт - отдельным запросом
+        with self.assertNumQueries(
+            4 if connection.vendor == 'postgresql' else 5
+        ):
+            response = self.client.post(f'/api/recipes/{recipe.pk}/favorite/')
+        self.assertEqual(response.status_code, 201)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+
+    def test_users_list(self):
+        self.assertConstantQueries('/api/users/?limit=20')
+
+    def test_subscriptions(self):
+        self.assertConstantQueries('/api/users/subscriptions/?limit=20')
+
+    def test_subscriptions_recipes_limit(self):
+        self.assertConstantQueries(
+            '/api/users/subscriptions/?limit=20&recipes_limit=3'
+        )
+
+
+class ParallelAddTest(TransactionTestCase):
+    """Параллельное добавление одного рецепта одним пользователем."""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite в памяти: нет параллельной записи')
+        self.user = User.objects.create(
+            username='reader', email='reader@foodgram.ru',
+            first_name='Читатель', last_name='Рецептов'
+        )
+        author = User.objects.create(
+            username='author', email='author@foodgram.ru',
+            first_name='Автор', last_name='Рецептов'
+        )
+        # без изображения: копии создаются в фоне после фиксации
+        self.recipe = Recipe.objects.create(
+            author=author, name='Рецепт', image='',
+            text='Описание', cooking_time=10
+        )
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, amount=100,
+            ingredient=Ingredient.objects.create(
+                name='Продукт', measurement_unit='г'
+            )
+        )
+
+    def assertTotalOnce(self):
+        self.assertEqual(
+            list(ShopListIngredient.objects.filter(
+                user=self.user
+            ).values_list('total_amount', 'recipe_count')),
+            [(100, 1)]
+        )
+
+    def post(self, url):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        try:
+            return client.post(url).status_code
+        finally:
+            connection.close()
+
+    def assertAddedOnce(self, url, counter):
+        with ThreadPoolExecutor(PARALLEL) as pool:
+            statuses = list(pool.map(self.post, [url] * PARALLEL))
+        self.assertEqual(statuses.count(201), 1, statuses)
+        self.assertEqual(statuses.count(400), PARALLEL - 1, statuses)
+        self.recipe.refresh_from_db()
+        self.assertEqual(getattr(self.recipe, counter), 1)
+
+    def test_favorite(self):
+        self.assertAddedOnce(
+            f'/api/recipes/{self.recipe.pk}/favorite/', 'favorites_count'
+        )
+
+    def test_shopping_cart(self):
+        self.assertAddedOnce(
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/', 'in_carts_count'
+        )
+        self.assertTotalOnce()
+
+    def post_batch(self, url):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        try:
+            response = client.post(
+                url, {'recipes': [self.recipe.pk]}, format='json'
+            )
+            return response.data['results'][0]['status']
+        finally:
+            connection.close()
+
+    def test_batch(self):
+        with ThreadPoolExecutor(PARALLEL) as pool:
+            statuses = list(pool.map(
+                self.post_batch, ['/api/recipes/shopping_cart/'] * PARALLEL
+            ))
+        self.assertEqual(statuses.count(201), 1, statuses)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.in_carts_count, 1)
+        self.assertTotalOnce()
+
+
+class RowSerializerTest(TestCase):
+    """RecipeRowSerializer и ORJSONRenderer отдают те же байты, что
+    RecipeSerializer и JSONRenderer."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@foodgram.ru',
+            first_name='Читатель', last_name='Рецептов'
+        )
+        tags = [
+            Tag.objects.create(
+                name=f'Тэг {i}', color='#E26C2D', slug=f'tag{i}'
+            )
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Продукт "{i}"', measurement_unit='г'
+            )
+            for i in range(4)
+        ]
+        authors = [cls.user] + [
+            User.objects.create(
+                username=f'author{i}', email=f'author{i}@foodgram.ru',
+                first_name='Автор', last_name=f'№{i}'
+            )
+            for i in range(2)
+        ]
+        for i in range(6):
+            author = authors[i % len(authors)]
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {i}',
+                image=f'recipes/recipe{i}.jpg',
+                text='Строка\nстрока\u2028абзац\u2029', cooking_time=i + 1
+            )
+            recipe.tags.set(tags[:i % 3 + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=amount
+                )
+                for amount, ingredient in enumerate(ingredients[i % 2:], 1)
+            )
+            if i % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if i % 3:
+                ShopList.objects.create(user=cls.user, recipe=recipe)
+        Follow.objects.create(user=cls.user, following=authors[1])
+        # в избранном, в покупках, автор в подписках
+        cls.recipe = Recipe.objects.get(name='Рецепт 1')
+
+    def get_queryset(self, request, action):
+        # action None - queryset с prefetch_related для RecipeSerializer
+        view = RecipeViewSet(
+            request=request, action=action, format_kwarg=None, kwargs={}
+        )
+        return view.filter_queryset(view.get_queryset())
+
+    def render(self, user):
+        """Список и один рецепт обоими способами: {способ: байты}."""
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        context = {'request': request}
+        recipes = self.get_queryset(request, None)
+        rows = self.get_queryset(request, 'list')
+        pk = self.recipe.pk
+        return {
+            'list': (
+                JSONRenderer().render(RecipeSerializer(
+                    recipes, many=True, context=context
+                ).data),
+                ORJSONRenderer().render(RecipeRowSerializer(
+                    rows, many=True, context=context
+                ).data),
+            ),
+            'detail': (
+                JSONRenderer().render(RecipeSerializer(
+                    recipes.get(pk=pk), context=context
+                ).data),
+                ORJSONRenderer().render(RecipeRowSerializer(
+                    rows.get(pk=pk), context=context
+                ).data),
+            ),
+        }
+
+    def assertSameBytes(self, user):
+        cache.clear()
+        # без фрагментов в кэше и с ними
+        for _ in range(2):
+            for name, (expected, content) in self.render(user).items():
+                with self.subTest(name):
+                    self.assertEqual(content, expected)
+
+    def test_anonymous(self):
+        self.assertSameBytes(AnonymousUser())
+
+    def test_authenticated(self):
+        self.assertSameBytes(self.user)
+
+
+class AsgiTest(TransactionTestCase):
+    """Под ASGI адреса и ответы те же, что под WSGI.
+
+    TransactionTestCase: представления ASGI выполняются в пуле потоков
+    со своими соединениями и видят только зафиксированные данные.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='reader', email='reader@foodgram.ru',
+            first_name='Читатель', last_name='Рецептов'
+        )
+        author = User.objects.create(
+            username='author', email='author@foodgram.ru',
+            first_name='Автор', last_name='Рецептов'
+        )
+        self.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        self.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        self.recipes = []
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {i}', image='',
+                text='Описание', cooking_time=10
+            )
+            recipe.tags.set([self.tag])
+            self.recipes.append(recipe)
+        self.auth = f'Token {Token.objects.create(user=self.user).key}'
+
+    def asgi(self, method, url, data=None):
+        async def request():
+            # заголовки AsyncClient в Django 3.2 - именованные аргументы
+            return await getattr(AsyncClient(), method)(
+                url, data, content_type='application/json',
+                authorization=self.auth
+            )
+        return async_to_sync(request)()
+
+    def wsgi(self, method, url, data=None):
+        return getattr(self.client, method)(
+            url, data, content_type='application/json',
+            HTTP_AUTHORIZATION=self.auth
+        )
+
+    def test_same_responses(self):
+        recipe = self.recipes[0]
+        for url in (
+            '/api/tags/',
+            f'/api/tags/{self.tag.pk}/',
+            '/api/ingredients/?name=Со',
+            f'/api/ingredients/{self.ingredient.pk}/',
+            '/api/recipes/',
+            f'/api/recipes/{recipe.pk}/',
+            '/api/recipes/download_shopping_cart/',
+        ):
+            with self.subTest(url):
+                expected = self.wsgi('get', url)
+                response = self.asgi('get', url)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.getvalue(), expected.getvalue())
+
+    def test_batch(self):
+        ids = [recipe.pk for recipe in self.recipes]
+        for url in ('/api/recipes/favorite/', '/api/recipes/shopping_cart/'):
+            for method, code in (('post', 201), ('delete', 204)):
+                with self.subTest(url, method=method):
+                    response = self.asgi(method, url, {'recipes': ids})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(
+                        [result['status']
+                         for result in response.json()['results']],
+                        [code] * len(ids)
+                    )
+
+    def test_single(self):
+        recipe = self.recipes[0]
+        for url in (
+            f'/api/recipes/{recipe.pk}/favorite/',
+            f'/api/recipes/{recipe.pk}/shopping_cart/',
+        ):
+            with self.subTest(url):
+                self.assertEqual(self.asgi('post', url).status_code, 201)
+                self.assertEqual(self.asgi('delete', url).status_code, 204)
+
+
+@override_settings(PROFILING=True, PROFILING_SAMPLE_RATE=1)
+class ProfilingTest(TransactionTestCase):
+    """Заголовки профилирования под WSGI и ASGI и /api/_debug/profile/."""
+
+    def setUp(self):
+        cache.clear()
+        slowest.clear()
+        self.admin = User.objects.create(
+            username='admin', email='admin@foodgram.ru',
+            first_name='Админ', last_name='Сайта', is_staff=True
+        )
+        for i in range(3):
+            Recipe.objects.create(
+                author=self.admin, name=f'Рецепт {i}', image='',
+                text='Описание', cooking_time=10
+            ).tags.set([Tag.objects.create(
+                name=f'Тэг {i}', color='#E26C2D', slug=f'tag{i}'
+            )])
+        self.auth = f'Token {Token.objects.create(user=self.admin).key}'
+
+    def asgi(self, url):
+        async def request():
+            return await AsyncClient().get(url, authorization=self.auth)
+        return async_to_sync(request)()
+
+    def wsgi(self, method, url):
+        return getattr(self.client, method)(
+            url, HTTP_AUTHORIZATION=self.auth
+        )
+
+    def test_headers(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.wsgi('get', '/api/recipes/')
+        self.assertEqual(response['X-Query-Count'], str(len(queries)))
+        self.assertRegex(
+            response['Server-Timing'],
+            rf'^db;dur=[\d.]+;desc="{len(queries)} queries", '
+            r'serializer;dur=[\d.]+, total;dur=[\d.]+$'
+        )
+
+    def test_asgi_headers(self):
+        # представления ASGI выполняются в пуле потоков, запросы к БД
+        # учитываются и там
+        for url in ('/api/recipes/', '/api/tags/', '/api/users/me/'):
+            with self.subTest(url):
+                cache.clear()
+                expected = self.wsgi('get', url)['X-Query-Count']
+                cache.clear()
+                response = self.asgi(url)
+                self.assertNotEqual(expected, '0')
+                self.assertEqual(response['X-Query-Count'], expected)
+
+    def test_profile_view(self):
+        count = self.wsgi('get', '/api/recipes/')['X-Query-Count']
+        entries = self.wsgi('get', '/api/_debug/profile/').json()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['path'], '/api/recipes/')
+        self.assertEqual(entries[0]['status'], 200)
+        self.assertEqual(str(entries[0]['query_count']), count)
+
+        response = self.wsgi('delete', '/api/_debug/profile/')
+        self.assertEqual(response.status_code, 204)
+        # записи добавляются после ответа: в списке - только очистка
+        self.assertEqual(
+            [entry['method'] for entry
+             in self.wsgi('get', '/api/_debug/profile/').json()],
+            ['DELETE']
+        )
+
+    def test_profile_view_admin_only(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(
+            username='reader', email='reader@foodgram.ru',
+            first_name='Читатель', last_name='Рецептов'
+        ))
+        self.assertEqual(
+            client.get('/api/_debug/profile/').status_code, 403
+        )
+
+
+class SearchTest(TestCase):
+    """Поиск по рецептам вместе с фильтрами и пагинацией."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@foodgram.ru',
+            first_name='Читатель', last_name='Рецептов'
+        )
+        cls.lunch = Tag.objects.create(
+            name='Обед', color='#E26C2D', slug='lunch'
+        )
+        recipes = (
+            ('Суп гороховый', 'Горох варить два часа', True),
+            ('Борщ', 'Подавать как суп со сметаной', True),
+            ('Суп грибной', 'Грибы обжарить', False),
+            ('Каша', 'Крупу варить на молоке', True),
+        )
+        cls.recipes = {}
+        for name, text, lunch in recipes:
+            recipe = Recipe.objects.create(
+                author=cls.user, name=name, image='recipes/recipe.jpg',
+                text=text, cooking_time=10
+            )
+            if lunch:
+                recipe.tags.set([cls.lunch])
+            cls.recipes[name] = recipe
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, params):
+        response = APIClient().get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        return data['count'], [recipe['name'] for recipe in data['results']]
+
+    def test_search(self):
+        count, names = self.search({'search': 'суп'})
+        self.assertEqual(count, 3)
+        # совпадение в названии выше совпадения в описании
+        self.assertEqual(
+            set(names[:2]), {'Суп гороховый', 'Суп грибной'}
+        )
+        self.assertEqual(names[2], 'Борщ')
+
+    def test_search_with_filter(self):
+        count, names = self.search({'search': 'суп', 'tags': 'lunch'})
+        self.assertEqual((count, names), (2, ['Суп гороховый', 'Борщ']))
+        count, names = self.search({
+            'search': 'суп', 'author': self.user.pk, 'tags': 'lunch'
+        })
+        self.assertEqual(count, 2)
+
+    def test_search_pages(self):
+        pages = [
+            self.search({'search': 'суп', 'limit': 1, 'page': page})
+            for page in (1, 2, 3)
+        ]
+        _, names = self.search({'search': 'суп'})
+        self.assertEqual([count for count, _ in pages], [3, 3, 3])
+        self.assertEqual(
+            [name for _, page in pages for name in page], names
+        )
+
+    def test_no_match(self):
+        self.assertEqual(self.search({'search': 'пирог'}), (0, []))
+        self.assertEqual(self.search({'search': '!!!'})[0], 0)
+
+
+class ReferenceCacheTest(TestCase):
+    """Версия тэгов и ингредиентов меняется только после фиксации."""
+
+    def setUp(self):
+        cache.clear()
+
+    def assertChangedOnCommit(self, url, create):
+        etag = APIClient().get(url)['ETag']
+        with self.captureOnCommitCallbacks() as callbacks:
+            create()
+            # до фиксации параллельный запрос получает прежнюю версию
+            response = APIClient().get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        for callback in callbacks:
+            callback()
+        response = APIClient().get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+
+    def test_tags(self):
+        self.assertChangedOnCommit('/api/tags/', lambda: Tag.objects.create(
+            name='Обед', color='#E26C2D', slug='lunch'
+        ))
+
+    def test_ingredients(self):
+        self.assertChangedOnCommit(
+            '/api/ingredients/', lambda: Ingredient.objects.create(
+                name='Соль', measurement_unit='г'
+            )
+        )
+
+
+class IngredientIndexTest(TestCase):
+    """Индекс автодополнения следует за версией 'ingredients'."""
+
+    def setUp(self):
+        cache.clear()
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+
+    def search(self, name):
+        response = APIClient().get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.json()]
+
+    def test_changed_after_commit(self):
+        self.assertEqual(self.search('с'), ['Соль'])
+        with self.captureOnCommitCallbacks() as callbacks:
+            Ingredient.objects.create(name='Сахар', measurement_unit='г')
+            # построение до фиксации не должно скрыть новый ингредиент
+            self.search('с')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.search('с'), ['Сахар', 'Соль'])
+
+    def test_changed_by_other_process(self):
+        self.assertEqual(self.search('с'), ['Соль'])
+        # как loadcsv: вставка без сигналов и смена версии
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='Сахар', measurement_unit='г')]
+        )
+        self.assertEqual(self.search('с'), ['Соль'])
+        bump_version('ingredients')
+        self.assertEqual(self.search('с'), ['Сахар', 'Соль'])
+
+
+class TokenCacheTest(TestCase):
+    """Кэш аутентификации сбрасывается при выходе и изменении
+    пользователя во всех процессах."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='reader', email='reader@foodgram.ru',
+            first_name='Читатель', last_name='Рецептов'
+        )
+        self.user.set_password('old-Pa55word')
+        self.user.save()
+        self.key = Token.objects.create(user=self.user).key
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+
+    def me(self):
+        return self.client.get('/api/users/me/').status_code
+
+    def assertCached(self):
+        self.assertEqual(self.me(), 200)
+        self.assertEqual(cache.get(token_cache_key(self.key)), self.user)
+        # пользователь из кэша, без запросов к БД
+        with self.assertNumQueries(0):
+            CachedTokenAuthentication().authenticate_credentials(self.key)
+
+    def assertRevoked(self):
+        self.assertEqual(cache.get(token_cache_key(self.key)), REVOKED)
+
+    def test_logout(self):
+        self.assertCached()
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertRevoked()
+        self.assertEqual(self.me(), 401)
+
+    def test_set_password(self):
+        self.assertCached()
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'old-Pa55word',
+            'new_password': 'new-Pa55word',
+        })
+        self.assertEqual(response.status_code, 204)
+        self.assertRevoked()
+        self.assertEqual(self.me(), 200)
+        # отметка не дает вернуть в кэш прочитанного из БД пользователя
+        self.assertRevoked()
+
+    def test_deactivation(self):
+        self.assertCached()
+        self.user.is_active = False
+        self.user.save()
+        self.assertRevoked()
+        self.assertEqual(self.me(), 401)
+
+    def test_stale_read_not_cached(self):
+        read = TokenAuthentication.authenticate_credentials
+        user = self.user
+
+        def read_then_change(auth, key):
+            # пользователь прочитан из БД до изменения, сброс кэша -
+            # раньше, чем запрос положил пользователя в кэш
+            result = read(auth, key)
+            user.save()
+            return result
+
+        with patch.object(
+            TokenAuthentication, 'authenticate_credentials', read_then_change
+        ):
+            CachedTokenAuthentication().authenticate_credentials(self.key)
+        self.assertRevoked()
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }})
+    def test_local_cache(self):
+        # сброс в кэше одного процесса не увидят другие процессы
+        self.assertEqual(self.me(), 200)
+        self.assertIsNone(cache.get(token_cache_key(self.key)))
+
+
+class ShopListTotalsTest(TestCase):
+    """Итоги списка покупок совпадают с пересчетом по спискам."""
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='reader', email='reader@foodgram.ru',
+            first_name='Читатель', last_name='Рецептов'
+        )
+        self.author = User.objects.create(
+            username='author', email='author@foodgram.ru',
+            first_name='Автор', last_name='Рецептов'
+        )
+        self.tag = Tag.objects.create(
+            name='Тэг', color='#E26C2D', slug='tag'
+        )
+        self.flour, self.milk, self.egg = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Мука', 'Молоко', 'Яйцо')
+        )
+        self.pancakes = self.add_recipe(
+            'Блины', {self.flour: 200, self.milk: 500, self.egg: 2}
+        )
+        self.omelette = self.add_recipe(
+            'Омлет', {self.milk: 100, self.egg: 3}
+        )
+        self.bread = self.add_recipe('Хлеб', {self.flour: 500})
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_recipe(self, name, amounts):
+        # без изображения: копии создаются в фоне после фиксации
+        recipe = Recipe.objects.create(
+            author=self.author, name=name, image='',
+            text='Описание', cooking_time=10
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=amount)
+            for ingredient, amount in amounts.items()
+        )
+        return recipe
+
+    def add(self, *recipes, user=None):
+        for recipe in recipes:
+            ShopList.objects.create(user=user or self.user, recipe=recipe)
+
+    def assertTotals(self, expected, user=None):
+        user = user or self.user
+        actual = {
+            name: (total_amount, recipe_count)
+            for name, total_amount, recipe_count
+            in ShopListIngredient.objects.filter(user=user).values_list(
+                'ingredient__name', 'total_amount', 'recipe_count'
+            )
+        }
+        self.assertEqual(actual, expected)
+        self.assertEqual(
+            {
+                (user_id, ingredient_id): value
+                for user_id, ingredient_id, *value
+                in ShopListIngredient.objects.filter(user=user).values_list(
+                    'user_id', 'ingredient_id', 'total_amount', 'recipe_count'
+                )
+            },
+            {key: list(value)
+             for key, value in shoplist.totals([user.id]).items()}
+        )
+
+    def test_cart_add_remove(self):
+        for recipe in (self.pancakes, self.omelette):
+            response = self.client.post(
+                f'/api/recipes/{recipe.pk}/shopping_cart/'
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertTotals({
+            'Мука': (200, 1), 'Молоко': (600, 2), 'Яйцо': (5, 2)
+        })
+        response = self.client.delete(
+            f'/api/recipes/{self.pancakes.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertTotals({'Молоко': (100, 1), 'Яйцо': (3, 1)})
+
+    def test_batch(self):
+        self.add(self.bread)
+        response = self.client.post(
+            '/api/recipes/shopping_cart/',
+            {'recipes': [self.pancakes.pk, self.bread.pk, self.omelette.pk]},
+            format='json'
+        )
+        self.assertEqual(
+            [row['status'] for row in response.data['results']],
+            [201, 400, 201]
+        )
+        self.assertTotals({
+            'Мука': (700, 2), 'Молоко': (600, 2), 'Яйцо': (5, 2)
+        })
+        response = self.client.delete(
+            '/api/recipes/shopping_cart/',
+            {'recipes': [self.pancakes.pk, self.bread.pk]},
+            format='json'
+        )
+        self.assertEqual(
+            [row['status'] for row in response.data['results']], [204, 204]
+        )
+        self.assertTotals({'Молоко': (100, 1), 'Яйцо': (3, 1)})
+
+    def test_recipe_edit(self):
+        self.add(self.pancakes, self.bread)
+        self.add(self.pancakes, user=self.author)
+        # ответ содержит ссылку на изображение, копии создаются после
+        # фиксации и в тесте не создаются
+        Recipe.objects.filter(pk=self.pancakes.pk).update(
+            image='recipes/images/pancakes.png'
+        )
+        client = APIClient()
+        client.force_authenticate(self.author)
+        response = client.patch(
+            f'/api/recipes/{self.pancakes.pk}/',
+            {
+                'ingredients': [
+                    {'id': self.flour.pk, 'amount': 300},
+                    {'id': self.egg.pk, 'amount': 2},
+                ],
+                'tags': [self.tag.pk],
+                'name': 'Блины',
+                'text': 'Без молока',
+                'cooking_time': 15,
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertTotals({'Мука': (800, 2), 'Яйцо': (2, 1)})
+        self.assertTotals(
+            {'Мука': (300, 1), 'Яйцо': (2, 1)}, user=self.author
+        )
+
+    def test_recipe_delete(self):
+        self.add(self.pancakes, self.omelette)
+        self.add(self.pancakes, user=self.author)
+        self.pancakes.delete()
+        self.assertTotals({'Молоко': (100, 1), 'Яйцо': (3, 1)})
+        self.assertTotals({}, user=self.author)
+
+    def test_user_delete(self):
+        self.add(self.pancakes, self.bread)
+        self.add(self.omelette, user=self.author)
+        self.user.delete()
+        self.assertFalse(
+            ShopListIngredient.objects.filter(user_id=self.user.pk).exists()
+        )
+        self.assertTotals({'Молоко': (100, 1), 'Яйцо': (3, 1)},
+                          user=self.author)
+        # у автора удаляются рецепты из чужих списков покупок
+        self.user = User.objects.create(
+            username='other', email='other@foodgram.ru',
+            first_name='Другой', last_name='Читатель'
+        )
+        self.add(self.bread, self.omelette)
+        self.author.delete()
+        self.assertTotals({})
+
+    def test_failed_delete(self):
+        self.add(self.pancakes, self.omelette)
+
+        def fail(**kwargs):
+            raise RuntimeError
+
+        # исключение между pre_delete и post_delete рецепта
+        post_delete.connect(fail, sender=RecipeIngredient)
+        try:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.pancakes.delete()
+        finally:
+            post_delete.disconnect(fail, sender=RecipeIngredient)
+        self.assertEqual(shoplist.deleting('recipe'), set())
+        ShopList.objects.filter(recipe=self.pancakes).delete()
+        self.assertTotals({'Молоко': (100, 1), 'Яйцо': (3, 1)})
+
+    def test_repair(self):
+        self.add(self.pancakes, self.omelette)
+        self.add(self.bread, user=self.author)
+        ShopListIngredient.objects.filter(
+            user=self.user, ingredient=self.milk
+        ).update(total_amount=1)
+        ShopListIngredient.objects.filter(
+            user=self.user, ingredient=self.egg
+        ).delete()
+        ShopListIngredient.objects.create(
+            user=self.author, ingredient=self.egg,
+            total_amount=3, recipe_count=1
+        )
+        out = StringIO()
+        call_command('recount', stdout=out)
+        self.assertIn('исправлено пользователей 2', out.getvalue())
+        self.assertTotals({
+            'Мука': (200, 1), 'Молоко': (600, 2), 'Яйцо': (5, 2)
+        })
+        self.assertTotals({'Мука': (500, 1)}, user=self.author)
+        self.assertEqual(shoplist.repair(), 0)
+
+
+@override_settings(REPLICA_DATABASES=[REPLICA])
+class ReplicaTest(TransactionTestCase):
+    """Чтение с реплики, запись и токены - с основной БД.
+
+    Реплика - второе соединение с той же тестовой БД: данные на ней
+    те же, а по запросам соединений видно, куда ушло чтение.
+    """
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='reader', email='reader@foodgram.ru',
+            first_name='Читатель', last_name='Рецептов'
+        )
+        self.recipe = Recipe.objects.create(
+            author=User.objects.create(
+                username='author', email='author@foodgram.ru',
+                first_name='Автор', last_name='Рецептов'
+            ),
+            name='Рецепт', image='', text='Описание', cooking_time=10
+        )
+        self.auth = f'Token {Token.objects.create(user=self.user).key}'
+
+    def request(self, method, url, auth=None):
+        """Ответ и SQL основной БД и реплики."""
+        headers = {'HTTP_AUTHORIZATION': auth} if auth else {}
+        with CaptureQueriesContext(connection) as primary, \
+                CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = getattr(self.client, method)(url, **headers)
+        self.assertLess(response.status_code, 400, response.content)
+        return (
+            response,
+            [query['sql'] for query in primary],
+            [query['sql'] for query in replica]
+        )
+
+    def test_read_from_replica(self):
+        # общие кэши (анонимный список, фрагменты рецептов, токены)
+        # заполняются с основной БД, после этого запросы - с реплики
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/'):
+            with self.subTest(url):
+                self.request('get', url, self.auth)
+                _, primary, replica = self.request('get', url, self.auth)
+                self.assertEqual(primary, [])
+                self.assertTrue(replica)
+
+    def test_token_from_primary(self):
+        _, primary, replica = self.request(
+            'get', '/api/recipes/', self.auth
+        )
+        self.assertTrue(any('authtoken_token' in sql for sql in primary))
+        self.assertFalse(any('authtoken_token' in sql for sql in replica))
+        self.assertTrue(replica)
+
+    def test_write_to_primary(self):
+        _, primary, replica = self.request(
+            'post', f'/api/recipes/{self.recipe.pk}/favorite/', self.auth
+        )
+        self.assertTrue(
+            any(sql.startswith('INSERT') for sql in primary), primary
+        )
+        self.assertEqual(replica, [])
+
+        # объект, прочитанный с реплики, сохраняется в основную БД
+        with use_replica(REPLICA):
+            recipe = Recipe.objects.get(pk=self.recipe.pk)
+        self.assertEqual(recipe._state.db, REPLICA)
+        with CaptureQueriesContext(connections[REPLICA]) as queries:
+            recipe.save()
+        self.assertEqual(len(queries), 0)
+
+    def test_sticky_after_write(self):
+        self.request(
+            'post', f'/api/recipes/{self.recipe.pk}/shopping_cart/',
+            self.auth
+        )
+        response, _, replica = self.request(
+            'get', '/api/recipes/?is_in_shopping_cart=1', self.auth
+        )
+        self.assertEqual(replica, [])
+        self.assertEqual(response.json()['count'], 1)
+        # другие клиенты читают с реплики
+        other = User.objects.create(
+            username='other', email='other@foodgram.ru',
+            first_name='Другой', last_name='Читатель'
+        )
+        _, _, replica = self.request(
+            'get', '/api/recipes/',
+            f'Token {Token.objects.create(user=other).key}'
+        )
+        self.assertTrue(replica)
+        # по окончании окна - снова с реплики
+        cache.delete(ReplicaMiddleware.sticky_key(
+            APIRequestFactory().get('/', HTTP_AUTHORIZATION=self.auth)
+        ))
+        _, _, replica = self.request(
+            'get', '/api/recipes/?is_in_shopping_cart=1', self.auth
+        )
+        self.assertTrue(replica)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }})
+    def test_local_cache(self):
+        # отметку об изменении в кэше процесса не увидят другие процессы
+        with self.assertRaises(ImproperlyConfigured):
+            ReplicaMiddleware(lambda request: None)
+
+
+def png(width, height):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class ImagesTest(TestCase):
+    """Загрузка изображений и уменьшенные копии."""
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.mkdtemp(prefix='foodgram_test_media')
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.author = User.objects.create(
+            username='author', email='author@foodgram.ru',
+            first_name='Автор', last_name='Рецептов'
+        )
+
+    def test_decode_base64(self):
+        content = os.urandom(images.DECODE_CHUNK * 2 + 5)
+        # переносы строк сдвигают куски base64 при декодировании
+        encoded = base64.encodebytes(content).decode()
+        with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024):
+            file = images.decode_base64(encoded, 'temp.png')
+        self.assertEqual(file.name, 'temp.png')
+        self.assertEqual(file.read(), content)
+
+    def test_decode_base64_invalid(self):
+        for data in ('abc', 'не base64'):
+            with self.subTest(data), self.assertRaises(images.ImageError):
+                images.decode_base64(data, 'temp.png')
+
+    def test_check_dimensions(self):
+        file = images.decode_base64(
+            base64.b64encode(png(20, 10)).decode(), 'temp.png'
+        )
+        images.check_dimensions(file)
+        # файл после проверки читается с начала
+        self.assertEqual(file.tell(), 0)
+        with override_settings(IMAGE_MAX_SIDE=15):
+            with self.assertRaises(images.ImageError):
+                images.check_dimensions(file)
+        self.assertEqual(file.tell(), 0)
+        with self.assertRaises(images.ImageError):
+            images.check_dimensions(File(BytesIO(b'not an image')))
+
+    def test_variant_urls(self):
+        name = default_storage.save('recipes/images/dish.png',
+                                    ContentFile(png(800, 400)))
+        original = default_storage.url(name)
+        with patch.object(
+            default_storage, 'exists', wraps=default_storage.exists
+        ) as exists:
+            for _ in range(2):
+                urls = images.variant_urls(name)
+        # пока копий нет - одна проверка хранилища
+        self.assertEqual(exists.call_count, 1)
+        self.assertEqual(
+            {url for formats in urls.values() for url in formats.values()},
+            {original}
+        )
+
+        images.make_variants(name)
+        with patch.object(default_storage, 'exists') as exists:
+            urls = images.variant_urls(name)
+        exists.assert_not_called()
+        self.assertEqual(
+            urls['small']['webp'],
+            default_storage.url(images.variant_name(name, 'small', 'webp'))
+        )
+
+    def test_delete_variants(self):
+        name = default_storage.save('recipes/images/dish.png',
+                                    ContentFile(png(800, 400)))
+        recipes = [
+            Recipe.objects.create(
+                author=self.author, name=f'Рецепт {i}', image=name,
+                text='Описание', cooking_time=10
+            )
+            for i in range(2)
+        ]
+        images.make_variants(name)
+        variants = [
+            images.variant_name(name, size, ext)
+            for size in settings.IMAGE_VARIANTS
+            for ext in images.VARIANT_FORMATS
+        ]
+
+        # копии для новых изображений в тесте не создаются
+        with patch('core.images._executor'), \
+                self.captureOnCommitCallbacks(execute=True):
+            recipes[0].delete()
+        # изображение еще используется другим рецептом
+        self.assertTrue(all(map(default_storage.exists, variants)))
+
+        with patch('core.images._executor'), \
+                self.captureOnCommitCallbacks(execute=True):
+            recipes[1].image = default_storage.save(
+                'recipes/images/other.png', ContentFile(png(10, 10))
+            )
+            recipes[1].save()
+        self.assertFalse(any(map(default_storage.exists, variants)))
+        self.assertFalse(images.variants_exist(name))
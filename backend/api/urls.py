@@ -3,7 +3,7 @@ from djoser.views import UserViewSet as DjoserViewSet
 from rest_framework.routers import DefaultRouter
 
 from users.views import UserViewSet
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+from .views import IngredientViewSet, ProfileView, RecipeViewSet, TagViewSet
 
 router_v1 = DefaultRouter()
 router_v1.register('tags', TagViewSet, basename='tags')
@@ -18,6 +18,7 @@ urlpatterns = [
         DjoserViewSet.as_view({'post': 'set_password'})
 
     ),
+    path('_debug/profile/', ProfileView.as_view()),
     path('', include(router_v1.urls)),
     path('auth/', include('djoser.urls.authtoken')),
 ]
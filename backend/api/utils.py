@@ -0,0 +1,58 @@
+import csv
+import json
+
+SHOP_LIST_HEADER = ('Ингредиент', 'Кол-во', 'ЕИ')
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer, возвращает записанную строку."""
+    def write(self, value):
+        return value
+
+
+def shop_list_txt(ingredients):
+    """Список покупок в виде текста с табуляцией."""
+    yield '\t'.join(SHOP_LIST_HEADER) + '\n'
+    separator = ''
+    for ingredient in ingredients:
+        yield (f'{separator}{ingredient["name"]}\t'
+               f'{ingredient["amount"]}\t'
+               f'{ingredient["measurement_unit"]}')
+        separator = '\n'
+
+
+def shop_list_csv(ingredients):
+    """Список покупок в формате csv."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(SHOP_LIST_HEADER)
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['name'],
+            ingredient['amount'],
+            ingredient['measurement_unit'],
+        ))
+
+
+def shop_list_json(ingredients):
+    """Список покупок в виде json массива."""
+    yield '['
+    separator = ''
+    for ingredient in ingredients:
+        yield separator + json.dumps(
+            {
+                'name': ingredient['name'],
+                'amount': ingredient['amount'],
+                'measurement_unit': ingredient['measurement_unit'],
+            },
+            ensure_ascii=False
+        )
+        separator = ','
+    yield ']'
+
+
+# формат файла: (тип содержимого, генератор содержимого)
+SHOP_LIST_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', shop_list_txt),
+    'csv': ('text/csv; charset=utf-8', shop_list_csv),
+    'json': ('application/json; charset=utf-8', shop_list_json),
+}
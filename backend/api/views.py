@@ -1,28 +1,67 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import BooleanField, Exists, F, OuterRef, Prefetch, Value
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import parse_etags, quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import permissions, status
 from rest_framework.decorators import action
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from core.pagination import PageLimitPagination
-from foods.models import Favorite, Ingredient, Recipe, ShopList, Tag
+from core import counters
+from core.middleware import slowest
+from core.pagination import RecipePagination
+from core.renderers import ORJSONRenderer
+from foods import links, shoplist
+from foods.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                          ShopList, ShopListIngredient, Tag)
+from users.models import Follow, User
 from .filters import IngredientFilter, RecipeFilter
+from .mixins import AnonymousListCacheMixin, VersionedCacheMixin
 from .permissions import AuthorOrReadOnly
-from .serializers import (FavoriteCreateSerializer, IngredientSerializer,
-                          RecipeCreateSerializer, RecipeSerializer,
-                          ShopListCreateSerializer, TagSerializer)
+from .serializers import (IngredientSerializer, RecipeCreateSerializer,
+                          RecipeIdsSerializer, RecipeRowSerializer,
+                          RecipeSerializer, RecipeShortSerializer,
+                          TagSerializer)
+from .utils import SHOP_LIST_FORMATS
 
+FAVORITE_ERRORS = {
+    'present': 'Рецепт уже находится в избранном',
+    'own': 'Недопустимо добавить свой рецепт в избранное',
+    'absent': 'Рецепт отсутствует в избранном',
+}
+SHOPPING_CART_ERRORS = {
+    'present': 'Рецепт уже находится в списке покупок',
+    'absent': 'Рецепт отсутствует в списке покупок',
+}
+# действия, которые отдают рецепты через RecipeRowSerializer
+ROW_ACTIONS = ('list', 'retrieve')
 
-class TagViewSet(ReadOnlyModelViewSet):
+
+class ProfileView(APIView):
+    """Самые медленные профилированные запросы процесса."""
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response(slowest.items())
+
+    def delete(self, request):
+        slowest.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class TagViewSet(VersionedCacheMixin, ReadOnlyModelViewSet):
+    cache_namespace = 'tags'
     queryset = Tag.objects.all()
     permission_classes = (permissions.AllowAny,)
     serializer_class = TagSerializer
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(VersionedCacheMixin, ReadOnlyModelViewSet):
+    cache_namespace = 'ingredients'
     queryset = Ingredient.objects.all()
     permission_classes = (permissions.AllowAny,)
     serializer_class = IngredientSerializer
@@ -30,18 +69,75 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     search_fields = ('^name',)
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(AnonymousListCacheMixin, ModelViewSet):
+    cache_namespace = 'recipes'
     queryset = Recipe.objects.all()
     permission_classes = (AuthorOrReadOnly,)
     serializer_class = RecipeSerializer
     http_method_names = ['get', 'post', 'patch', 'delete']
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
-    pagination_class = PageLimitPagination
+    pagination_class = RecipePagination
+    renderer_classes = (ORJSONRenderer, BrowsableAPIRenderer)
+
+    def get_queryset(self):
+        user = self.request.user
+        # флаги текущего пользователя вычисляем в одном запросе со списком,
+        # а не отдельным запросом на каждый рецепт
+        if user.is_authenticated:
+            is_favorited = Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            )
+            is_in_shopping_cart = Exists(
+                ShopList.objects.filter(user=user, recipe=OuterRef('pk'))
+            )
+
+            def is_subscribed(author):
+                return Exists(Follow.objects.filter(
+                    user=user, following=OuterRef(author)
+                ))
+        else:
+            is_favorited = is_in_shopping_cart = Value(
+                False, output_field=BooleanField()
+            )
+
+            def is_subscribed(author):
+                return Value(False, output_field=BooleanField())
+
+        queryset = Recipe.objects.annotate(
+            is_favorited=is_favorited,
+            is_in_shopping_cart=is_in_shopping_cart,
+        )
+        if self.action in ROW_ACTIONS:
+            # остальное RecipeRowSerializer загружает для всей страницы
+            return queryset.annotate(
+                author_is_subscribed=is_subscribed('author')
+            )
+        return queryset.prefetch_related(
+            Prefetch(
+                'author',
+                queryset=User.objects.annotate(
+                    is_subscribed=is_subscribed('pk')
+                )
+            ),
+            'tags',
+            Prefetch(
+                'rec_ingrs',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in ROW_ACTIONS:
+            return queryset.values(*RecipeRowSerializer.ROW_FIELDS)
+        return queryset
 
     def get_serializer_class(self):
         if self.request.method in ('POST', 'PATCH'):
             return RecipeCreateSerializer
+        if self.action in ROW_ACTIONS:
+            return RecipeRowSerializer
         return super().get_serializer_class()
 
     @action(
@@ -49,81 +145,214 @@ class RecipeViewSet(ModelViewSet):
         methods=['post', 'delete']
     )
     def favorite(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
-
         if request.method == 'POST':
-            serializer = FavoriteCreateSerializer(
-                data={'user': request.user.id, 'recipe': recipe.id})
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-        cnt, obj = Favorite.objects.filter(
-            user=self.request.user.id,
-            recipe=pk
-        ).delete()
-
-        if cnt:
-            return Response(status=status.HTTP_204_NO_CONTENT)
-
-        return Response(
-            {"errors": 'Рецепт отсутствует в избранном'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+            return self.add_link(
+                request, pk, Favorite, FAVORITE_ERRORS, allow_own=False
+            )
+        return self.delete_link(request, pk, Favorite, FAVORITE_ERRORS)
 
     @action(
         detail=True,
         methods=['post', 'delete']
     )
     def shopping_cart(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
-
         if request.method == 'POST':
-            serializer = ShopListCreateSerializer(
-                data={'user': request.user.id, 'recipe': recipe.id})
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return self.add_link(request, pk, ShopList, SHOPPING_CART_ERRORS)
+        return self.delete_link(request, pk, ShopList, SHOPPING_CART_ERRORS)
+
+    @staticmethod
+    def add_link(request, pk, model, errors, allow_own=True):
+        """Добавление одной командой INSERT, причина отказа выясняется
+        только при неудаче."""
+        try:
+            recipe_id = int(pk)
+        except ValueError:
+            raise Http404
+        recipe = links.add(model, request.user.id, recipe_id, allow_own)
+        if recipe is not None:
+            return Response(
+                RecipeShortSerializer(recipe).data,
+                status=status.HTTP_201_CREATED
+            )
 
-        cnt, obj = ShopList.objects.filter(
-            user=self.request.user.id,
-            recipe=pk
-        ).delete()
+        author_id = Recipe.objects.filter(pk=recipe_id).values_list(
+            'author_id', flat=True
+        ).first()
+        if author_id is None:
+            raise Http404
+        if not allow_own and author_id == request.user.id:
+            return Response(
+                {'following': [errors['own']]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(
+            {'non_field_errors': [errors['present']]},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @staticmethod
+    def delete_link(request, pk, model, errors):
+        recipe = get_object_or_404(Recipe, pk=pk)
+        with transaction.atomic():
+            links.lock_user(request.user.id)
+            cnt, obj = model.objects.filter(
+                user=request.user.id,
+                recipe=recipe
+            ).delete()
 
         if cnt:
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         return Response(
-            {"errors": 'Рецепт отсутствует в списке покупок'},
+            {"errors": errors['absent']},
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    def get_batch_ids(self, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['recipes']
+
+    def add_batch(self, request, model, errors, allow_own=True):
+        """Добавление связей пользователя с рецептами одним INSERT.
+
+        Результат по каждому id - по строкам, которые действительно
+        добавлены, причина отказа выясняется для остальных.
+        """
+        ids = self.get_batch_ids(request)
+        user = request.user
+        created = links.add_many(model, user.id, ids, allow_own)
+        recipes = Recipe.objects.filter(pk__in=ids).only(
+            *links.RECIPE_FIELDS, 'author_id'
+        ).in_bulk()
+
+        results = []
+        for pk in ids:
+            recipe = recipes.get(pk)
+            if recipe is None:
+                results.append({
+                    'id': pk,
+                    'status': status.HTTP_404_NOT_FOUND,
+                    'errors': 'Рецепт не найден'
+                })
+            elif pk in created:
+                results.append({
+                    'id': pk,
+                    'status': status.HTTP_201_CREATED,
+                    'recipe': RecipeShortSerializer(recipe).data
+                })
+            else:
+                own = not allow_own and recipe.author_id == user.id
+                results.append({
+                    'id': pk,
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': errors['own' if own else 'present']
+                })
+        return Response({'results': results})
+
+    def delete_batch(self, request, model, errors):
+        """Удаление связей пользователя с рецептами одним DELETE."""
+        ids = self.get_batch_ids(request)
+        user = request.user
+        with transaction.atomic():
+            links.lock_user(user.pk)
+            deleted = list(
+                model.objects.filter(user=user, recipe_id__in=ids)
+            )
+            if deleted:
+                # учет ведем одним обновлением, а не по сигналу на строку
+                with counters.suspended(), shoplist.suspended():
+                    model.objects.filter(
+                        pk__in=[obj.pk for obj in deleted]
+                    ).delete()
+                counters.related_deleted(model, deleted)
+                if model is ShopList:
+                    shoplist.apply_recipes(
+                        user.id, [obj.recipe_id for obj in deleted], -1
+                    )
+
+        deleted_ids = {obj.recipe_id for obj in deleted}
+        return Response({'results': [
+            {'id': pk, 'status': status.HTTP_204_NO_CONTENT}
+            if pk in deleted_ids else
+            {'id': pk, 'status': status.HTTP_400_BAD_REQUEST,
+             'errors': errors['absent']}
+            for pk in ids
+        ]})
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[permissions.IsAuthenticated],
+        url_path='favorite',
+        url_name='favorite-batch'
+    )
+    def favorite_batch(self, request):
+        if request.method == 'POST':
+            return self.add_batch(
+                request, Favorite, FAVORITE_ERRORS, allow_own=False
+            )
+        return self.delete_batch(request, Favorite, FAVORITE_ERRORS)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[permissions.IsAuthenticated],
+        url_path='shopping_cart',
+        url_name='shopping-cart-batch'
+    )
+    def shopping_cart_batch(self, request):
+        if request.method == 'POST':
+            return self.add_batch(request, ShopList, SHOPPING_CART_ERRORS)
+        return self.delete_batch(request, ShopList, SHOPPING_CART_ERRORS)
+
     @action(
         permission_classes=[permissions.IsAuthenticated],
         detail=False,
     )
     def download_shopping_cart(self, request):
-        ingredients = Ingredient.objects.filter(
-            rec_ingrs__recipe__in=Recipe.objects.filter(
-                shoplists__user=request.user
+        file_type = request.query_params.get('type', 'txt')
+        if file_type not in SHOP_LIST_FORMATS:
+            return Response(
+                {'errors': 'Допустимые форматы: '
+                           f'{", ".join(SHOP_LIST_FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        ).annotate(sum_amount=Sum('rec_ingrs__amount'))
 
-        return RecipeViewSet.fill_data_file(ingredients)
+        # итоги поддерживаются при изменении списка покупок,
+        # версия итогов позволяет не выгружать файл повторно
+        etag = quote_etag(
+            f'shoplist-{request.user.id}-'
+            f'{shoplist.get_version(request.user.id)}-{file_type}'
+        )
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+
+        ingredients = ShopListIngredient.objects.filter(
+            user=request.user
+        ).values(
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+            amount=F('total_amount'),
+        ).order_by('ingredient__name', 'ingredient__measurement_unit')
+
+        response = RecipeViewSet.fill_data_file(
+            ingredients.iterator(), file_type
+        )
+        response['ETag'] = etag
+        return response
 
     @staticmethod
-    def fill_data_file(ingredients):
-        content = 'Ингредиент\tКол-во\tЕИ\n' + (
-            '\n'.join([f'{ingredient.name}\t'
-                       f'{ingredient.sum_amount}\t'
-                       f'{ingredient.measurement_unit}'
-                       for ingredient in ingredients]))
-
-        return HttpResponse(
-            content,
-            content_type='text/plain',
+    def fill_data_file(ingredients, file_type='txt'):
+        content_type, generator = SHOP_LIST_FORMATS[file_type]
+
+        return StreamingHttpResponse(
+            generator(ingredients),
+            content_type=content_type,
             headers={
                 "Content-Disposition":
-                'attachment; filename="Список покупок.txt"'
+                f'attachment; filename="Список покупок.{file_type}"'
             },
         )
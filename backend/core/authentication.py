@@ -0,0 +1,81 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from core.cache import digest, is_shared
+
+TOKEN_KEY = 'auth-token:{}'
+# отметка вместо пользователя: токен отозван или пользователь изменен
+REVOKED = 'revoked'
+
+
+def token_cache_key(key: str) -> str:
+    # сам токен в ключ кэша не попадает
+    return TOKEN_KEY.format(digest(key))
+
+
+def invalidate_tokens(*keys):
+    """Сброс токенов в кэше аутентификации.
+
+    Вместо удаления на время жизни записи ставится отметка REVOKED:
+    запрос, прочитавший пользователя из БД до изменения, не вернет его
+    в кэш (cache.add).
+    """
+    cache.set_many(
+        {token_cache_key(key): REVOKED for key in keys},
+        settings.TOKEN_CACHE_TTL
+    )
+
+
+def invalidate_user(user_id):
+    invalidate_tokens(
+        *Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+    )
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication с кэшированием пользователя по токену.
+
+    Запись живет TOKEN_CACHE_TTL секунд и сбрасывается сигналами при
+    удалении токена (выход), сохранении и удалении пользователя. Сброс
+    в одном процессе должны видеть все, поэтому с кэшем одного процесса
+    (locmem) пользователь каждый раз читается из БД.
+    """
+    hits = 0
+    misses = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def count(cls, name):
+        with cls._lock:
+            setattr(cls, name, getattr(cls, name) + 1)
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Попадания и промахи кэша в текущем процессе."""
+        return {'hits': cls.hits, 'misses': cls.misses}
+
+    def authenticate_credentials(self, key):
+        if not is_shared():
+            return super().authenticate_credentials(key)
+        cache_key = token_cache_key(key)
+        user = cache.get(cache_key)
+        if user is None or user == REVOKED:
+            self.count('misses')
+            user, token = super().authenticate_credentials(key)
+            # add не перезапишет отметку REVOKED, поставленную после
+            # чтения из БД
+            cache.add(cache_key, user, settings.TOKEN_CACHE_TTL)
+            return user, token
+
+        self.count('hits')
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return user, Token(key=key, user=user)
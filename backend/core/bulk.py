@@ -0,0 +1,187 @@
+import csv
+import io
+
+from django.core.management.color import no_style
+from django.db import connection, models
+
+# сколько ошибочных строк выводить для одного файла
+MAX_REPORTED_ERRORS = 20
+
+
+def copy_supported() -> bool:
+    """COPY FROM STDIN доступен только для PostgreSQL."""
+    return connection.vendor == 'postgresql'
+
+
+def reset_sequences(*model_list: models.Model):
+    """Сдвиг последовательностей первичных ключей после явных id."""
+    statements = connection.ops.sequence_reset_sql(no_style(), model_list)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+class CopyLoader:
+    """Загрузка CSV в таблицу модели через COPY и промежуточную таблицу.
+
+    Строки сначала копируются во временную таблицу без ограничений,
+    затем строки с нарушением NOT NULL, внешних ключей и уникальности
+    отбрасываются с указанием номера строки файла, остальные переносятся
+    в таблицу модели одним INSERT ... SELECT.
+    """
+    line_column = 'loadcsv_line'
+
+    def __init__(self, model: models.Model):
+        self.model = model
+        self.table = model._meta.db_table
+        self.stage = f'{self.table}_stage'
+        self.fields = {
+            field.column: field for field in model._meta.concrete_fields
+        }
+        self.errors = []
+        self.rejected = 0
+
+    def quote(self, name: str) -> str:
+        return connection.ops.quote_name(name)
+
+    def load(self, file: io.TextIOBase) -> int:
+        """Загрузка файла, возвращает количество добавленных строк."""
+        columns = next(csv.reader([file.readline()]))
+        unknown = set(columns) - set(self.fields)
+        if unknown:
+            raise ValueError(f'неизвестные колонки: {", ".join(unknown)}')
+        self.columns = columns
+        file.seek(0)
+
+        with connection.cursor() as cursor:
+            self.cursor = cursor
+            self.create_stage()
+            try:
+                cursor.copy_expert(
+                    f'COPY {self.quote(self.stage)} '
+                    f'({self.column_list(columns)}) '
+                    'FROM STDIN WITH (FORMAT csv, HEADER true)',
+                    file
+                )
+                self.fill_defaults()
+                self.check_not_null()
+                self.check_foreign_keys()
+                self.check_unique()
+                return self.merge()
+            finally:
+                cursor.execute(f'DROP TABLE {self.quote(self.stage)}')
+
+    def column_list(self, columns) -> str:
+        return ', '.join(self.quote(column) for column in columns)
+
+    def create_stage(self):
+        # копия структуры без ограничений, номер строки файла
+        # проставляется последовательностью в порядке чтения
+        self.cursor.execute(
+            f'CREATE TEMP TABLE {self.quote(self.stage)} AS '
+            f'SELECT * FROM {self.quote(self.table)} WITH NO DATA'
+        )
+        self.cursor.execute(
+            f'ALTER TABLE {self.quote(self.stage)} '
+            f'ADD COLUMN {self.line_column} bigserial'
+        )
+
+    def fill_defaults(self):
+        """Значения по умолчанию для колонок, которых нет в файле."""
+        for column, field in self.fields.items():
+            if column in self.columns or not field.has_default():
+                continue
+            value = field.get_db_prep_save(
+                field.get_default(), connection=connection
+            )
+            self.cursor.execute(
+                f'UPDATE {self.quote(self.stage)} '
+                f'SET {self.quote(column)} = %s',
+                [value]
+            )
+            self.columns.append(column)
+
+    def reject(self, where: str, message: str, params=()):
+        """Удаление из промежуточной таблицы строк по условию с отчетом."""
+        self.cursor.execute(
+            f'DELETE FROM {self.quote(self.stage)} AS s WHERE {where} '
+            f'RETURNING s.{self.line_column}',
+            params
+        )
+        lines = sorted(row[0] for row in self.cursor.fetchall())
+        self.rejected += len(lines)
+        # номер строки в файле с учетом заголовка
+        self.errors.extend(
+            f'строка {line + 1}: {message}' for line in lines
+        )
+
+    def check_not_null(self):
+        for column in self.columns:
+            if self.fields[column].null:
+                continue
+            self.reject(
+                f's.{self.quote(column)} IS NULL',
+                f'{column} не заполнено'
+            )
+
+    def check_foreign_keys(self):
+        for column in self.columns:
+            field = self.fields[column]
+            if not field.is_relation:
+                continue
+            target = field.target_field
+            self.reject(
+                f's.{self.quote(column)} IS NOT NULL AND NOT EXISTS ('
+                f'SELECT 1 FROM {self.quote(target.model._meta.db_table)} r '
+                f'WHERE r.{self.quote(target.column)} = '
+                f's.{self.quote(column)})',
+                f'{column} ссылается на отсутствующую запись'
+            )
+
+    def unique_sets(self):
+        opts = self.model._meta
+        for field in opts.concrete_fields:
+            if field.unique:
+                yield (field.column,)
+        for fields in opts.unique_together:
+            yield tuple(opts.get_field(name).column for name in fields)
+        for constraint in opts.total_unique_constraints:
+            yield tuple(
+                opts.get_field(name).column for name in constraint.fields
+            )
+
+    def check_unique(self):
+        for columns in self.unique_sets():
+            if not set(columns) <= set(self.columns):
+                continue
+            names = ', '.join(columns)
+            partition = ', '.join(f's.{self.quote(c)}' for c in columns)
+            match = ' AND '.join(
+                f't.{self.quote(c)} = s.{self.quote(c)}' for c in columns
+            )
+            # повтор внутри файла, первая строка остается
+            self.reject(
+                f's.{self.line_column} IN ('
+                f'SELECT {self.line_column} FROM ('
+                f'SELECT s.{self.line_column}, ROW_NUMBER() OVER ('
+                f'PARTITION BY {partition} ORDER BY s.{self.line_column}'
+                f') AS rn FROM {self.quote(self.stage)} s) d '
+                'WHERE d.rn > 1)',
+                f'повтор значения ({names}) в файле'
+            )
+            # конфликт с уже существующими записями
+            self.reject(
+                f'EXISTS (SELECT 1 FROM {self.quote(self.table)} t '
+                f'WHERE {match})',
+                f'запись с таким ({names}) уже существует'
+            )
+
+    def merge(self) -> int:
+        columns = self.column_list(self.columns)
+        self.cursor.execute(
+            f'INSERT INTO {self.quote(self.table)} ({columns}) '
+            f'SELECT {columns} FROM {self.quote(self.stage)} '
+            f'ORDER BY {self.line_column}'
+        )
+        return self.cursor.rowcount
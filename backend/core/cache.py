@@ -0,0 +1,97 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .routers import primary
+
+VERSION_KEY = 'version:{}'
+# блокировка построения значения: время жизни и ожидание, сек.
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 5
+LOCK_POLL = 0.05
+# кэши, которые видит только один процесс
+LOCAL_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def is_shared() -> bool:
+    """Кэш общий для всех процессов сервера."""
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_BACKENDS
+
+
+def get_version(namespace: str) -> int:
+    """Текущая версия данных пространства имен."""
+    key = VERSION_KEY.format(namespace)
+    version = cache.get(key)
+    if version is None:
+        # начальное значение от времени, чтобы после вытеснения ключа
+        # из кэша версия не совпала с уже выданной клиентам
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_versions(namespaces) -> dict:
+    """Версии нескольких пространств имен одним обращением к кэшу."""
+    keys = {
+        namespace: VERSION_KEY.format(namespace) for namespace in namespaces
+    }
+    found = cache.get_many(keys.values())
+    versions = {}
+    for namespace, key in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = get_version(namespace)
+        versions[namespace] = version
+    return versions
+
+
+def bump_version(namespace: str) -> int:
+    """Смена версии данных, старые записи кэша перестают читаться.
+
+    Новая версия - новое значение, а не incr: в файловом кэше incr не
+    атомарен, и два процесса могли бы выдать одну и ту же версию.
+    """
+    version = time.time_ns()
+    cache.set(VERSION_KEY.format(namespace), version, None)
+    return version
+
+
+def digest(value: str) -> str:
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def get_or_build(key: str, build):
+    """Значение из кэша, при отсутствии - build().
+
+    Одновременные запросы к отсутствующему ключу ждут, пока значение
+    построит тот, кто первым взял блокировку (cache.add). Если значение
+    не появилось за LOCK_WAIT, строят сами. Значение строится по
+    основной БД: реплика могла еще не получить изменение, сменившее
+    версию.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+    lock = f'{key}:lock'
+    if not cache.add(lock, 1, LOCK_TIMEOUT):
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL)
+            value = cache.get(key)
+            if value is not None:
+                return value
+        with primary():
+            return build()
+    try:
+        with primary():
+            value = build()
+        cache.set(key, value)
+    finally:
+        cache.delete(lock)
+    return value
@@ -17,3 +17,6 @@ USERNAME_PATTERN = r'^[\w.@+-]+'
 NAME_PATTERN = r'^[^\s\d]{1}\w{2,}'
 
 PAGE_SIZE = 6
+
+# наибольшее количество рецептов в одном пакетном запросе
+BATCH_RECIPES = 100
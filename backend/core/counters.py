@@ -0,0 +1,141 @@
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from foods.models import Favorite, Recipe, ShopList
+from users.models import Follow, User
+
+
+class CounterField:
+    """Счетчик связанных записей, хранимый в поле модели."""
+    def __init__(self, model, field, related_model, related_field):
+        self.model = model
+        self.field = field
+        self.related_model = related_model
+        self.related_field = related_field
+
+    def __str__(self):
+        return f'{self.model.__name__}.{self.field}'
+
+    def target_id(self, related):
+        """id записи со счетчиком для связанной записи."""
+        return getattr(related, f'{self.related_field}_id')
+
+    def change(self, pks, delta):
+        """Изменение счетчика записей pks на delta, не ниже нуля."""
+        value = (
+            F(self.field) + delta if delta > 0
+            else Greatest(F(self.field) + delta, 0)
+        )
+        return self.model.objects.filter(pk__in=pks).update(
+            **{self.field: value}
+        )
+
+    def apply(self, target_ids, sign=1):
+        """Учет пачки добавленных (sign=1) или удаленных (sign=-1) связей.
+
+        Записи группируются по величине изменения, одна команда UPDATE
+        на каждую величину.
+        """
+        by_delta = {}
+        for pk, count in Counter(target_ids).items():
+            by_delta.setdefault(count * sign, []).append(pk)
+        for delta, pks in by_delta.items():
+            self.change(pks, delta)
+
+    def actual(self):
+        """Подзапрос с фактическим количеством связанных записей."""
+        return Coalesce(
+            Subquery(
+                self.related_model.objects.filter(
+                    **{self.related_field: OuterRef('pk')}
+                ).order_by().values(self.related_field).annotate(
+                    count=Count('pk')
+                ).values('count')
+            ),
+            0
+        )
+
+    def repair(self, pks):
+        """Исправление расхождений для записей pks, возвращает их число."""
+        drifted = list(
+            self.model.objects.filter(pk__in=pks).annotate(
+                actual=self.actual()
+            ).exclude(**{self.field: F('actual')}).values_list(
+                'pk', flat=True
+            )
+        )
+        if drifted:
+            self.model.objects.filter(pk__in=drifted).update(
+                **{self.field: self.actual()}
+            )
+        return len(drifted)
+
+
+COUNTERS = (
+    CounterField(Recipe, 'favorites_count', Favorite, 'recipe'),
+    CounterField(Recipe, 'in_carts_count', ShopList, 'recipe'),
+    CounterField(User, 'recipes_count', Recipe, 'author'),
+    CounterField(User, 'followers_count', Follow, 'following'),
+)
+
+_state = threading.local()
+
+
+def counters_for(related_model):
+    return [
+        counter for counter in COUNTERS
+        if counter.related_model is related_model
+    ]
+
+
+def is_suspended():
+    return getattr(_state, 'suspended', False)
+
+
+@contextmanager
+def suspended():
+    """Отключение учета по сигналам, например при массовой загрузке,
+    после которой счетчики пересчитываются целиком."""
+    previous = is_suspended()
+    _state.suspended = True
+    try:
+        yield
+    finally:
+        _state.suspended = previous
+
+
+def related_created(related_model, objs):
+    """Учет связей, добавленных в обход сигналов (bulk_create)."""
+    for counter in counters_for(related_model):
+        counter.apply([counter.target_id(obj) for obj in objs], 1)
+
+
+def related_deleted(related_model, objs):
+    """Учет связей, удаленных в обход сигналов."""
+    for counter in counters_for(related_model):
+        counter.apply([counter.target_id(obj) for obj in objs], -1)
+
+
+def recount(batch_size=1000, counters=COUNTERS):
+    """Пересчет счетчиков пачками, возвращает число исправленных записей
+    по каждому счетчику."""
+    result = {}
+    for counter in counters:
+        repaired = 0
+        last_pk = 0
+        while True:
+            pks = list(
+                counter.model.objects.filter(pk__gt=last_pk).order_by(
+                    'pk'
+                ).values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            repaired += counter.repair(pks)
+            last_pk = pks[-1]
+        result[str(counter)] = repaired
+    return result
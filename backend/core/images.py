@@ -0,0 +1,182 @@
+import base64
+import logging
+import posixpath
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.dispatch import Signal
+from PIL import Image
+
+from .cache import digest
+
+logger = logging.getLogger(__name__)
+
+# размер куска base64 текста при декодировании, кратен 4
+DECODE_CHUNK = 64 * 1024
+# форматы уменьшенных копий: расширение - формат Pillow
+VARIANT_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+VARIANT_DIR = 'variants'
+# пробельные символы, которые удаляются из base64 перед декодированием
+ASCII_WHITESPACE = str.maketrans('', '', ' \t\r\n\v\f')
+# сколько секунд помнить, что копий нет: создание копий в другом
+# процессе при локальном кэше отметку не обновит
+MISSING_TTL = 60
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_WORKERS, thread_name_prefix='images'
+)
+
+
+# копии изображения name созданы, ссылки на них можно отдавать
+variants_ready = Signal()
+
+
+class ImageError(ValueError):
+    """Некорректное изображение."""
+
+
+def decode_base64(data: str, name: str) -> File:
+    """Декодирование base64 по частям во временный файл."""
+    # куски должны быть выровнены по 4 символа base64
+    data = data.translate(ASCII_WHITESPACE)
+    spooled = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+    )
+    try:
+        for start in range(0, len(data), DECODE_CHUNK):
+            spooled.write(
+                base64.b64decode(data[start:start + DECODE_CHUNK])
+            )
+    except ValueError:
+        # binascii.Error и символы не из ASCII
+        spooled.close()
+        raise ImageError('Некорректные данные base64')
+    spooled.seek(0)
+    return File(spooled, name=name)
+
+
+def check_dimensions(file: File):
+    """Проверка размеров по заголовку, без декодирования всего файла."""
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    except (OSError, Image.DecompressionBombError):
+        raise ImageError('Загрузите корректное изображение')
+    finally:
+        file.seek(0)
+    max_side = settings.IMAGE_MAX_SIDE
+    if width > max_side or height > max_side:
+        raise ImageError(
+            f'Размер изображения не должен превышать {max_side}px'
+        )
+
+
+def variant_name(name: str, size: str, ext: str) -> str:
+    """Имя уменьшенной копии изображения."""
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, VARIANT_DIR, f'{stem}_{size}.{ext}')
+
+
+def ready_key(name: str) -> str:
+    return f'variants:{digest(name)}'
+
+
+def variants_exist(name: str) -> bool:
+    """Копии изображения созданы.
+
+    Отметку ставит make_variants, без нее хранилище проверяется
+    один раз, результат запоминается до создания копий.
+    """
+    ready = cache.get(ready_key(name))
+    if ready is None:
+        first = next(iter(settings.IMAGE_VARIANTS), None)
+        ready = first is not None and default_storage.exists(
+            variant_name(name, first, next(iter(VARIANT_FORMATS)))
+        )
+        # add не затирает отметку, поставленную за время проверки
+        cache.add(ready_key(name), ready, None if ready else MISSING_TTL)
+    return ready
+
+
+def variant_urls(image) -> dict:
+    """Ссылки на уменьшенные копии: {размер: {формат: url}}.
+
+    image - файл изображения или его имя. Копии создаются после
+    сохранения в фоне, пока копии нет, отдается ссылка на исходное
+    изображение.
+    """
+    name = getattr(image, 'name', image)
+    if not name:
+        return {}
+    ready = variants_exist(name)
+    original = default_storage.url(name)
+    return {
+        size: {
+            ext: default_storage.url(variant_name(name, size, ext))
+            if ready else original
+            for ext in VARIANT_FORMATS
+        }
+        for size in settings.IMAGE_VARIANTS
+    }
+
+
+def delete_variants(name: str):
+    """Удаление копий изображения, которое больше не используется."""
+    cache.delete(ready_key(name))
+    for size in settings.IMAGE_VARIANTS:
+        for ext in VARIANT_FORMATS:
+            variant = variant_name(name, size, ext)
+            try:
+                default_storage.delete(variant)
+            except OSError:
+                logger.exception('Не удалось удалить копию %s', variant)
+
+
+def make_variants(name: str):
+    """Создание уменьшенных копий исходного изображения."""
+    with default_storage.open(name) as file, Image.open(file) as original:
+        original.load()
+        for size, side in settings.IMAGE_VARIANTS.items():
+            image = original.copy()
+            image.thumbnail((side, side))
+            for ext, image_format in VARIANT_FORMATS.items():
+                target = variant_name(name, size, ext)
+                buffer = BytesIO()
+                variant = image
+                if image_format == 'JPEG' and image.mode != 'RGB':
+                    variant = image.convert('RGB')
+                variant.save(buffer, image_format, quality=85)
+                if default_storage.exists(target):
+                    default_storage.delete(target)
+                default_storage.save(target, ContentFile(buffer.getvalue()))
+    cache.set(ready_key(name), True, None)
+    variants_ready.send(sender=None, name=name)
+
+
+def _make_variants_logged(name: str):
+    # имена загруженных файлов уникальны, готовые копии не пересоздаем
+    if not settings.IMAGE_VARIANTS or variants_exist(name):
+        return
+    try:
+        make_variants(name)
+    except Exception:
+        logger.exception('Не удалось создать копии изображения %s', name)
+    finally:
+        # соединение потока пула открыто обработчиками variants_ready
+        close_old_connections()
+
+
+def schedule_variants(name: str):
+    """Создание копий в пуле потоков после фиксации транзакции."""
+    if name:
+        transaction.on_commit(
+            lambda: _executor.submit(_make_variants_logged, name)
+        )
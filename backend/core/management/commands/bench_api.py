@@ -0,0 +1,264 @@
+import json
+import statistics
+import time
+import tracemalloc
+from contextlib import ExitStack
+from itertools import combinations, cycle
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.middleware import RequestProfile
+from foods.models import Ingredient, Recipe, Tag
+from users.models import User
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу."""
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, round(percent / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def consume(response):
+    # потоковый ответ формируется при чтении
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер основных запросов API: задержка, запросы к БД и память. '
+        'Изменения данных откатываются по окончании'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Количество повторов каждого сценария'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=2,
+            help='Количество прогонов без замера'
+        )
+        parser.add_argument(
+            '--user', help='email пользователя, от имени которого запросы'
+        )
+        parser.add_argument(
+            '--only', help='Сценарии, название которых начинается с ...'
+        )
+        parser.add_argument(
+            '--output', help='Файл для сохранения результатов в JSON'
+        )
+        parser.add_argument(
+            '--compare', help='JSON файл прошлого запуска для сравнения'
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        scenarios = self.get_scenarios(user)
+        if options['only']:
+            scenarios = [
+                scenario for scenario in scenarios
+                if scenario[0].startswith(options['only'])
+            ]
+
+        results = {}
+        with transaction.atomic():
+            for name, func in scenarios:
+                results[name] = self.run(
+                    func, options['repeat'], options['warmup']
+                )
+                self.print_result(name, results[name])
+            transaction.set_rollback(True)
+
+        report = {
+            'date': timezone.now().isoformat(),
+            'vendor': connection.vendor,
+            'repeat': options['repeat'],
+            'rows': {
+                model.__name__: model.objects.count()
+                for model in (User, Recipe, Tag, Ingredient)
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    @staticmethod
+    def get_user(email):
+        if email:
+            user = User.objects.filter(email=email).first()
+            if user is None:
+                raise CommandError(f'Пользователь {email} не найден')
+            return user
+        # больше всего подписок - самый тяжелый список подписок
+        user = User.objects.annotate(
+            follows=Count('follower')
+        ).order_by('-follows', 'id').first()
+        if user is None or not Recipe.objects.exists():
+            raise CommandError('Нет данных для замера')
+        return user
+
+    def get_client(self, user=None):
+        host = next(
+            (host for host in settings.ALLOWED_HOSTS if '*' not in host),
+            'localhost'
+        ).lstrip('.')
+        client = APIClient(SERVER_NAME=host)
+        if user is not None:
+            token, _ = Token.objects.get_or_create(user=user)
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def get_scenarios(self, user):
+        client = self.get_client(user)
+        anonymous = self.get_client()
+        author = User.objects.order_by('-recipes_count', 'id').first()
+        recipe = Recipe.objects.order_by('-favorites_count', 'id').first()
+        # рецепт, которого нет у пользователя, для переключения
+        toggle = Recipe.objects.exclude(author=user).exclude(
+            favorites__user=user
+        ).exclude(shoplists__user=user).order_by('id').first()
+        slugs = list(Tag.objects.values_list('slug', flat=True)[:2])
+        word = recipe.name.split()[0]
+        names = list(
+            Ingredient.objects.values_list('name', flat=True)[:20]
+        )
+        prefixes = [name[:1 + i % 3] for i, name in enumerate(names)]
+
+        filters = {
+            'is_favorited': '1',
+            'is_in_shopping_cart': '1',
+            'author': str(author.id),
+            'tags': slugs,
+            'search': word,
+        }
+        scenarios = [
+            ('recipes anonymous', lambda: anonymous.get('/api/recipes/')),
+        ]
+        for size in range(len(filters) + 1):
+            for names_set in combinations(filters, size):
+                params = {name: filters[name] for name in names_set}
+                title = '+'.join(names_set) or 'no filters'
+                scenarios.append((
+                    f'recipes {title}',
+                    lambda params=params: client.get('/api/recipes/', params)
+                ))
+        scenarios += [
+            ('recipes cursor', lambda: client.get(
+                '/api/recipes/', {'cursor': ''}
+            )),
+            ('recipe detail', lambda: client.get(
+                f'/api/recipes/{recipe.id}/'
+            )),
+            ('subscriptions', lambda: client.get(
+                '/api/users/subscriptions/', {'recipes_limit': 3}
+            )),
+        ]
+        for file_type in ('txt', 'csv', 'json'):
+            scenarios.append((
+                f'download_shopping_cart {file_type}',
+                lambda file_type=file_type: client.get(
+                    '/api/recipes/download_shopping_cart/',
+                    {'type': file_type}
+                )
+            ))
+        if prefixes:
+            prefix_iter = cycle(prefixes)
+            scenarios.append(('ingredient search', lambda: anonymous.get(
+                '/api/ingredients/', {'name': next(prefix_iter)}
+            )))
+        if toggle is not None:
+            for action in ('favorite', 'shopping_cart'):
+                url = f'/api/recipes/{toggle.id}/{action}/'
+                scenarios.append((
+                    f'{action} toggle',
+                    lambda url=url: (client.post(url), client.delete(url))
+                ))
+        return scenarios
+
+    @staticmethod
+    def call(func):
+        """Вызов сценария, проверка статуса ответов."""
+        responses = func()
+        if not isinstance(responses, tuple):
+            responses = (responses,)
+        for response in responses:
+            consume(response)
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'{response.status_code}: {response.content[:200]}'
+                )
+
+    def run(self, func, repeat, warmup):
+        for _ in range(warmup):
+            self.call(func)
+
+        times = []
+        queries = []
+        for _ in range(repeat):
+            profile = RequestProfile()
+            with ExitStack() as stack:
+                for db in connections.all():
+                    stack.enter_context(db.execute_wrapper(profile))
+                start = time.perf_counter()
+                self.call(func)
+                times.append((time.perf_counter() - start) * 1000)
+            queries.append(profile.query_count)
+
+        # память отдельным прогоном, tracemalloc замедляет выполнение
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            self.call(func)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        result = {
+            f'p{percent}': round(percentile(times, percent), 3)
+            for percent in PERCENTILES
+        }
+        result.update(
+            mean=round(statistics.mean(times), 3),
+            max=round(max(times), 3),
+            queries=max(queries),
+            peak_kb=round((peak - before) / 1024, 1),
+            retained_kb=round((current - before) / 1024, 1),
+        )
+        return result
+
+    def print_result(self, name, result):
+        self.stdout.write(
+            f'{name:<60} p50 {result["p50"]:8.2f} мс  '
+            f'p95 {result["p95"]:8.2f} мс  '
+            f'запросов {result["queries"]:3}  '
+            f'память {result["peak_kb"]:8.1f} КБ'
+        )
+
+    def compare(self, path, results):
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)['results']
+        self.stdout.write(f'\nсравнение с {path} (p50):')
+        for name, result in results.items():
+            if name not in previous:
+                continue
+            old = previous[name]['p50']
+            change = (result['p50'] - old) / old * 100 if old else 0
+            self.stdout.write(
+                f'{name:<60} {old:8.2f} -> {result["p50"]:8.2f} мс '
+                f'({change:+.1f}%)  запросов '
+                f'{previous[name]["queries"]} -> {result["queries"]}'
+            )
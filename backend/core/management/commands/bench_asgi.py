@@ -0,0 +1,183 @@
+import importlib.util
+import json
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from foods.models import Ingredient, Recipe, Tag
+from users.models import User
+from .bench_api import PERCENTILES, percentile
+
+# время ожидания запуска сервера, с
+START_TIMEOUT = 30
+
+SERVERS = {
+    # как в Dockerfile, синхронные воркеры
+    'wsgi': ('gunicorn', lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', 'foodgram.wsgi',
+        '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+    ]),
+    'asgi': ('uvicorn', lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', 'foodgram.asgi:application',
+        '--host', '127.0.0.1', '--port', str(port),
+        '--workers', str(workers), '--no-access-log',
+    ]),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнение пропускной способности API под gunicorn (WSGI) и '
+        'uvicorn (ASGI) при параллельных запросах'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', default='1,10,50',
+            help='Количество параллельных клиентов через запятую'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Количество запросов на каждый адрес и уровень'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Количество процессов сервера'
+        )
+        parser.add_argument(
+            '--servers', default='wsgi,asgi',
+            help='Серверы через запятую: wsgi, asgi'
+        )
+        parser.add_argument(
+            '--output', help='Файл для сохранения результатов в JSON'
+        )
+
+    def handle(self, *args, **options):
+        servers = options['servers'].split(',')
+        for server in servers:
+            if server not in SERVERS:
+                raise CommandError(f'Неизвестный сервер {server}')
+            module = SERVERS[server][0]
+            if importlib.util.find_spec(module) is None:
+                raise CommandError(f'Не установлен {module}')
+        levels = [int(level) for level in options['concurrency'].split(',')]
+
+        host = next(
+            (host for host in settings.ALLOWED_HOSTS if '*' not in host),
+            'localhost'
+        ).lstrip('.')
+        paths = self.get_paths()
+        results = {}
+        for server in servers:
+            port = free_port()
+            process = self.start(server, port, options['workers'], host)
+            try:
+                for path, headers in paths:
+                    user = 'token' if headers else 'anonymous'
+                    headers = {'Host': host, **headers}
+                    for level in levels:
+                        name = f'{server} {path} {user} x{level}'
+                        results[name] = self.run(
+                            f'http://127.0.0.1:{port}{path}', headers,
+                            level, options['requests']
+                        )
+                        self.print_result(name, results[name])
+            finally:
+                process.terminate()
+                process.wait()
+
+        if options['output']:
+            report = {
+                'date': timezone.now().isoformat(),
+                'workers': options['workers'],
+                'requests': options['requests'],
+                'results': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def get_paths():
+        recipe = Recipe.objects.order_by('-favorites_count', 'id').first()
+        tag = Tag.objects.order_by('id').first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        user = User.objects.order_by('-recipes_count', 'id').first()
+        if None in (recipe, tag, ingredient, user):
+            raise CommandError('Нет данных для замера')
+        token, _ = Token.objects.get_or_create(user=user)
+        auth = {'Authorization': f'Token {token.key}'}
+        search = urlencode({'name': ingredient.name[:2]})
+        return [
+            ('/api/tags/', {}),
+            (f'/api/ingredients/?{search}', {}),
+            ('/api/recipes/', {}),
+            ('/api/recipes/', auth),
+            (f'/api/recipes/{recipe.id}/', auth),
+            ('/api/recipes/download_shopping_cart/', auth),
+        ]
+
+    def start(self, server, port, workers, host):
+        command = SERVERS[server][1](port, workers)
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR)
+        url = f'http://127.0.0.1:{port}/api/tags/'
+        deadline = time.monotonic() + START_TIMEOUT
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'{server}: сервер завершился')
+            try:
+                self.fetch(url, {'Host': host})
+                return process
+            except (OSError, CommandError):
+                time.sleep(0.2)
+        process.terminate()
+        raise CommandError(f'{server}: сервер не запустился')
+
+    @staticmethod
+    def fetch(url, headers):
+        request = urllib.request.Request(url, headers=headers)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+        except urllib.error.HTTPError as err:
+            raise CommandError(f'{url}: {err.code}')
+        return (time.perf_counter() - start) * 1000
+
+    def run(self, url, headers, concurrency, requests):
+        # прогрев каждого соединения и кэшей
+        self.fetch(url, headers)
+        with ThreadPoolExecutor(concurrency) as pool:
+            start = time.perf_counter()
+            times = list(pool.map(
+                lambda _: self.fetch(url, headers), range(requests)
+            ))
+            elapsed = time.perf_counter() - start
+
+        result = {
+            f'p{percent}': round(percentile(times, percent), 3)
+            for percent in PERCENTILES
+        }
+        result['rps'] = round(requests / elapsed, 1)
+        return result
+
+    def print_result(self, name, result):
+        self.stdout.write(
+            f'{name:<70} {result["rps"]:8.1f} запр/с  '
+            f'p50 {result["p50"]:8.2f} мс  p95 {result["p95"]:8.2f} мс'
+        )
@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from foods.autocomplete import ingredient_index
+from foods.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Сравнение поиска ингредиентов: ORM и индекс в памяти'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help='Количество повторов каждого запроса'
+        )
+        parser.add_argument(
+            '--prefixes', type=int, default=30,
+            help='Количество различных префиксов'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=0,
+            help='Ограничение количества результатов, 0 - без ограничения'
+        )
+
+    @staticmethod
+    def measure(func, prefixes, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for prefix in prefixes:
+                func(prefix)
+        return (time.perf_counter() - start) / (repeat * len(prefixes))
+
+    def handle(self, *args, **options):
+        names = list(
+            Ingredient.objects.values_list('name', flat=True)
+            [:options['prefixes']]
+        )
+        if not names:
+            self.stdout.write('Нет ингредиентов для проверки')
+            return
+        # как при наборе в поле ввода: первые 1-3 символа
+        prefixes = [name[:1 + i % 3] for i, name in enumerate(names)]
+        limit = options['limit']
+
+        def orm_search(prefix):
+            queryset = Ingredient.objects.filter(name__istartswith=prefix)
+            return list(queryset[:limit] if limit else queryset)
+
+        def index_search(prefix):
+            return ingredient_index.search(prefix, limit)
+
+        start = time.perf_counter()
+        ingredient_index.mark_stale()
+        index_search('')
+        build = time.perf_counter() - start
+
+        orm = self.measure(orm_search, prefixes, options['repeat'])
+        index = self.measure(index_search, prefixes, options['repeat'])
+
+        self.stdout.write(
+            f'ингредиентов: {Ingredient.objects.count()}, '
+            f'префиксов: {len(prefixes)}, повторов: {options["repeat"]}\n'
+            f'построение индекса: {build * 1000:.2f} мс\n'
+            f'ORM:    {orm * 1e6:10.1f} мкс/запрос\n'
+            f'индекс: {index * 1e6:10.1f} мкс/запрос\n'
+            f'ускорение: x{orm / index:.1f}'
+        )
@@ -0,0 +1,111 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.serializers import RecipeRowSerializer, RecipeSerializer
+from api.views import RecipeViewSet
+from core.renderers import ORJSONRenderer, orjson
+from users.models import User
+from .bench_api import PERCENTILES, percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Время отображения рецептов: RecipeSerializer и JSONRenderer против '
+        'RecipeRowSerializer и ORJSONRenderer. Совпадение ответов '
+        'проверяет api.tests.RowSerializerTest'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=100,
+            help='Количество рецептов в замере'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Количество повторов'
+        )
+        parser.add_argument(
+            '--user', help='email пользователя, от имени которого запросы'
+        )
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэш перед каждым повтором (без кэша фрагментов)'
+        )
+
+    def handle(self, *args, **options):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        if options['user']:
+            request.user = User.objects.filter(email=options['user']).first()
+            if request.user is None:
+                raise CommandError(f'Пользователь {options["user"]} не найден')
+        count = options['recipes']
+        if orjson is None:
+            self.stdout.write('orjson не установлен, ORJSONRenderer = json')
+
+        paths = {
+            'RecipeSerializer': (
+                lambda: list(self.get_queryset(request, None)[:count]),
+                lambda recipes: RecipeSerializer(
+                    recipes, many=True, context={'request': request}
+                ).data,
+                JSONRenderer(),
+            ),
+            'RecipeRowSerializer': (
+                lambda: list(self.get_queryset(request, 'list')[:count]),
+                lambda rows: RecipeRowSerializer(
+                    rows, many=True, context={'request': request}
+                ).data,
+                ORJSONRenderer(),
+            ),
+        }
+        for name, (fetch, serialize, renderer) in paths.items():
+            self.run(
+                name, fetch, serialize, renderer, options['repeat'],
+                options['cold']
+            )
+
+    @staticmethod
+    def get_queryset(request, action):
+        # action None - queryset с prefetch_related для RecipeSerializer
+        view = RecipeViewSet(
+            request=request, action=action, format_kwarg=None, kwargs={}
+        )
+        return view.filter_queryset(view.get_queryset())
+
+    def run(self, name, fetch, serialize, renderer, repeat, cold):
+        stages = {'fetch': [], 'serialize': [], 'render': []}
+        for _ in range(repeat):
+            if cold:
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                objects = fetch()
+                fetched = time.perf_counter()
+                data = serialize(objects)
+                serialized = time.perf_counter()
+            renderer.render(data)
+            rendered = time.perf_counter()
+            stages['fetch'].append((fetched - start) * 1000)
+            stages['serialize'].append((serialized - fetched) * 1000)
+            stages['render'].append((rendered - serialized) * 1000)
+
+        total = [sum(times) for times in zip(*stages.values())]
+        line = '  '.join(
+            f'{stage} {percentile(times, 50):7.2f}'
+            for stage, times in stages.items()
+        )
+        self.stdout.write(
+            f'{name:<20} {len(objects)} рецептов, мс (p50): {line}  '
+            + '  '.join(
+                f'всего p{percent} {percentile(total, percent):7.2f}'
+                for percent in PERCENTILES[:2]
+            )
+            + f'  запросов {len(queries)}'
+        )
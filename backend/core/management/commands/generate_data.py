@@ -0,0 +1,390 @@
+import csv
+import datetime
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core import counters
+from core.bulk import CopyLoader, copy_supported, reset_sequences
+from core.cache import bump_version
+from foods import shoplist
+from foods.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                          RecipeTag, ShopList, Tag)
+from users.models import Follow, User
+
+BATCH_SIZE = 5000
+# показатель степени распределения популярности (закон Ципфа)
+POPULARITY_EXPONENT = 1.1
+# начало периода публикации рецептов
+START_DATE = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+PUBLISH_PERIOD = 3 * 365 * 24 * 60 * 60
+
+DISHES = (
+    'суп', 'салат', 'пирог', 'каша', 'рагу', 'плов', 'торт', 'омлет',
+    'борщ', 'запеканка', 'котлеты', 'блины', 'паста', 'соус', 'жаркое',
+)
+VARIANTS = (
+    'по-домашнему', 'с грибами', 'с курицей', 'с сыром', 'без мяса',
+    'на скорую руку', 'к празднику', 'с овощами', 'с перцем', 'по-деревенски',
+)
+WORDS = (
+    'нарезать', 'добавить', 'варить', 'обжарить', 'посолить', 'перемешать',
+    'лук', 'морковь', 'масло', 'минут', 'огонь', 'сковорода', 'кастрюля',
+    'подавать', 'горячим', 'зелень', 'чеснок', 'перец', 'тесто', 'духовка',
+)
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+
+
+def next_id(model: models.Model) -> int:
+    return (model.objects.aggregate(value=Max('id'))['value'] or 0) + 1
+
+
+def popularity(count: int) -> list:
+    """Накопленные веса для выбора по закону Ципфа: первые - популярнее."""
+    return list(accumulate(
+        1 / (rank + 1) ** POPULARITY_EXPONENT for rank in range(count)
+    ))
+
+
+@contextmanager
+def explicit_pub_date():
+    """Сохранение заданной даты публикации вместо текущего времени."""
+    field = Recipe._meta.get_field('pub_date')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерация синтетических данных для замеров производительности. '
+        'При одинаковом --seed данные совпадают'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='Количество новых пользователей'
+        )
+        parser.add_argument(
+            '--recipes-per-author', type=float, default=5,
+            help='Среднее количество рецептов у пользователя'
+        )
+        parser.add_argument(
+            '--tags', type=int, default=10,
+            help='Наименьшее количество тэгов в базе'
+        )
+        parser.add_argument(
+            '--ingredients', type=int, default=2000,
+            help='Наименьшее количество ингредиентов в базе'
+        )
+        parser.add_argument(
+            '--tags-per-recipe', type=int, default=3,
+            help='Наибольшее количество тэгов у рецепта'
+        )
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, default=8,
+            help='Наибольшее количество ингредиентов у рецепта'
+        )
+        parser.add_argument(
+            '--favorites', type=float, default=20,
+            help='Среднее количество избранных рецептов у пользователя'
+        )
+        parser.add_argument(
+            '--carts', type=float, default=5,
+            help='Среднее количество рецептов в списке покупок'
+        )
+        parser.add_argument(
+            '--follows', type=float, default=10,
+            help='Среднее количество подписок у пользователя'
+        )
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            '--mode', choices=('auto', 'copy', 'bulk'), default='auto',
+            help='copy - COPY FROM STDIN (PostgreSQL), bulk - bulk_create, '
+                 'auto - copy если доступен'
+        )
+
+    def handle(self, *args, **options):
+        self.use_copy = options['mode'] == 'copy' or (
+            options['mode'] == 'auto' and copy_supported()
+        )
+        if self.use_copy and not copy_supported():
+            raise CommandError('COPY поддерживается только для PostgreSQL')
+        self.batch_size = options['batch_size']
+        self.random = random.Random(options['seed'])
+        self.options = options
+
+        start = time.perf_counter()
+        with transaction.atomic(), counters.suspended(), \
+                shoplist.suspended(), explicit_pub_date():
+            tag_ids = self.generate_tags()
+            ingredient_ids = self.generate_ingredients()
+            user_ids = self.generate_users()
+            recipes = self.generate_recipes(user_ids)
+            self.generate_recipe_links(recipes, tag_ids, ingredient_ids)
+            self.generate_choices(Favorite, user_ids, recipes, 'favorites')
+            self.generate_choices(ShopList, user_ids, recipes, 'carts')
+            self.generate_follows(user_ids, recipes)
+
+            # id заданы явно, последовательности нужно сдвинуть
+            reset_sequences(
+                Tag, Ingredient, User, Recipe, RecipeTag,
+                RecipeIngredient, Favorite, ShopList, Follow
+            )
+            self.step('счетчики', lambda: counters.recount(self.batch_size))
+            self.step('списки покупок', self.rebuild_shoplists)
+
+        # сигналы при массовой вставке не срабатывают
+        for namespace in ('tags', 'ingredients', 'recipes'):
+            bump_version(namespace)
+        self.stdout.write(f'всего: {time.perf_counter() - start:.1f} с')
+
+    def step(self, title, func):
+        start = time.perf_counter()
+        func()
+        self.stdout.write(f'{title}: {time.perf_counter() - start:.2f} с')
+
+    def write(self, model: models.Model, columns, rows) -> int:
+        """Вставка строк (кортежей значений columns) в таблицу модели."""
+        start = time.perf_counter()
+        if self.use_copy:
+            with tempfile.TemporaryFile('w+', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(columns)
+                writer.writerows(rows)
+                file.seek(0)
+                loader = CopyLoader(model)
+                count = loader.load(file)
+                if loader.errors:
+                    raise CommandError(
+                        f'{model.__name__}: {loader.errors[0]}'
+                    )
+        else:
+            count = 0
+            rows = iter(rows)
+            while True:
+                batch = [
+                    model(**dict(zip(columns, row)))
+                    for row in islice(rows, self.batch_size)
+                ]
+                if not batch:
+                    break
+                model.objects.bulk_create(batch, batch_size=self.batch_size)
+                count += len(batch)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'{model.__name__}: {count} строк за {elapsed:.2f} с '
+            f'({count / elapsed if elapsed else 0:.0f} строк/с)'
+        )
+        return count
+
+    def generate_tags(self) -> list:
+        missing = self.options['tags'] - Tag.objects.count()
+        if missing > 0:
+            first = next_id(Tag)
+            self.write(Tag, ('id', 'name', 'color', 'slug'), (
+                (pk, f'тэг {pk}', f'#{self.random.randrange(0x1000000):06X}',
+                 f'tag-{pk}')
+                for pk in range(first, first + missing)
+            ))
+        return list(Tag.objects.order_by('id').values_list('id', flat=True))
+
+    def generate_ingredients(self) -> list:
+        missing = self.options['ingredients'] - Ingredient.objects.count()
+        if missing > 0:
+            first = next_id(Ingredient)
+            self.write(Ingredient, ('id', 'name', 'measurement_unit'), (
+                (pk, f'ингредиент {pk}', self.random.choice(UNITS))
+                for pk in range(first, first + missing)
+            ))
+        return list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+
+    def generate_users(self) -> list:
+        first = next_id(User)
+        user_ids = list(range(first, first + self.options['users']))
+        # вход по паролю сгенерированным пользователям не нужен
+        password = make_password(None)
+        joined = timezone.now()
+        self.write(User, (
+            'id', 'username', 'email', 'first_name', 'last_name', 'password',
+            'is_superuser', 'is_staff', 'is_active', 'date_joined'
+        ), (
+            (pk, f'user{pk}', f'user{pk}@example.com', 'Имя', f'Фамилия{pk}',
+             password, False, False, True, joined)
+            for pk in user_ids
+        ))
+        return user_ids
+
+    def recipes_count(self) -> int:
+        # распределение Парето со средним --recipes-per-author:
+        # большинство пишет мало, немногие - очень много
+        mean = self.options['recipes_per_author']
+        return int(mean * (self.random.paretovariate(2) - 1))
+
+    def generate_recipes(self, user_ids) -> list:
+        """Рецепты новых пользователей, возвращает [(id, author_id)]."""
+        first = next_id(Recipe)
+        recipes = []
+        for author_id in user_ids:
+            for _ in range(self.recipes_count()):
+                recipes.append((first + len(recipes), author_id))
+
+        def rows():
+            for pk, author_id in recipes:
+                words = self.random.choices(
+                    WORDS, k=self.random.randint(5, 30)
+                )
+                yield (
+                    pk,
+                    f'{self.random.choice(DISHES).capitalize()} '
+                    f'{self.random.choice(VARIANTS)} {pk}',
+                    author_id,
+                    START_DATE + datetime.timedelta(
+                        seconds=self.random.randrange(PUBLISH_PERIOD)
+                    ),
+                    'recipes/generated.jpg',
+                    ' '.join(words).capitalize() + '.',
+                    self.random.randint(1, 180),
+                )
+
+        self.write(Recipe, (
+            'id', 'name', 'author_id', 'pub_date', 'image', 'text',
+            'cooking_time'
+        ), rows())
+        return recipes
+
+    def generate_recipe_links(self, recipes, tag_ids, ingredient_ids):
+        max_tags = min(self.options['tags_per_recipe'], len(tag_ids))
+        max_ingredients = min(
+            self.options['ingredients_per_recipe'], len(ingredient_ids)
+        )
+        # популярные ингредиенты встречаются чаще
+        weights = popularity(len(ingredient_ids))
+
+        def tag_rows():
+            pk = next_id(RecipeTag)
+            for recipe_id, _ in recipes:
+                for tag_id in self.random.sample(
+                    tag_ids, self.random.randint(1, max_tags)
+                ):
+                    yield pk, recipe_id, tag_id
+                    pk += 1
+
+        def ingredient_rows():
+            pk = next_id(RecipeIngredient)
+            for recipe_id, _ in recipes:
+                chosen = self.choose(
+                    ingredient_ids, weights,
+                    self.random.randint(1, max_ingredients)
+                )
+                for ingredient_id in chosen:
+                    yield (
+                        pk, recipe_id, ingredient_id,
+                        self.random.randint(1, 500)
+                    )
+                    pk += 1
+
+        if max_tags:
+            self.write(
+                RecipeTag, ('id', 'recipe_id', 'tag_id'), tag_rows()
+            )
+        if max_ingredients:
+            self.write(
+                RecipeIngredient,
+                ('id', 'recipe_id', 'ingredient_id', 'amount'),
+                ingredient_rows()
+            )
+
+    def choose(self, population, weights, count, exclude=()):
+        """Различные элементы с учетом популярности, не более count."""
+        chosen = []
+        seen = set(exclude)
+        # повторы отбрасываются, попыток с запасом
+        for item in self.random.choices(
+            population, cum_weights=weights, k=count * 2
+        ):
+            if item not in seen:
+                seen.add(item)
+                chosen.append(item)
+                if len(chosen) == count:
+                    break
+        return chosen
+
+    def count_for_user(self, mean) -> int:
+        return int(self.random.expovariate(1 / mean)) if mean > 0 else 0
+
+    def generate_choices(self, model, user_ids, recipes, option):
+        """Избранное или список покупок: популярные рецепты выбирают чаще,
+        свои рецепты не выбираются."""
+        if not recipes:
+            return
+        ranked = list(recipes)
+        self.random.shuffle(ranked)
+        recipe_ids = [pk for pk, _ in ranked]
+        weights = popularity(len(recipe_ids))
+        own = {}
+        for pk, author_id in recipes:
+            own.setdefault(author_id, []).append(pk)
+
+        def rows():
+            pk = next_id(model)
+            for user_id in user_ids:
+                for recipe_id in self.choose(
+                    recipe_ids, weights,
+                    self.count_for_user(self.options[option]),
+                    own.get(user_id, ())
+                ):
+                    yield pk, user_id, recipe_id
+                    pk += 1
+
+        self.write(model, ('id', 'user_id', 'recipe_id'), rows())
+
+    def generate_follows(self, user_ids, recipes):
+        """Подписки: на авторов с большим числом рецептов подписываются
+        чаще."""
+        authored = {}
+        for _, author_id in recipes:
+            authored[author_id] = authored.get(author_id, 0) + 1
+        authors = sorted(authored, key=lambda pk: (-authored[pk], pk))
+        if not authors:
+            return
+        weights = popularity(len(authors))
+
+        def rows():
+            pk = next_id(Follow)
+            for user_id in user_ids:
+                for author_id in self.choose(
+                    authors, weights,
+                    self.count_for_user(self.options['follows']),
+                    (user_id,)
+                ):
+                    yield pk, user_id, author_id
+                    pk += 1
+
+        self.write(Follow, ('id', 'user_id', 'following_id'), rows())
+
+    def rebuild_shoplists(self):
+        user_ids = ShopList.objects.values_list(
+            'user_id', flat=True
+        ).distinct().order_by('user_id')
+        last = 0
+        while True:
+            batch = list(user_ids.filter(user_id__gt=last)[:self.batch_size])
+            if not batch:
+                break
+            shoplist.rebuild(batch)
+            last = batch[-1]
@@ -1,126 +1,150 @@
 import csv
 import os
+import time
+from itertools import islice
 from pathlib import Path
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
-from django.db import models
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from foods import shoplist
 from foods.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                          RecipeTag, Tag)
+                          RecipeTag, ShopList, Tag)
 from users.models import Follow, User
 
+from core import counters
+from core.cache import bump_version
+from core.bulk import (MAX_REPORTED_ERRORS, CopyLoader, copy_supported,
+                       reset_sequences)
+
+BATCH_SIZE = 1000
+
+
+def get_ids(model: models.Model) -> set:
+    """Множество существующих id модели."""
+    return set(model.objects.values_list('id', flat=True))
+
+
+def check_id(ids: set, value: str, name: str) -> int:
+    """Проверка ссылки на существующую запись без запроса к БД."""
+    value = int(value)
+    if value not in ids:
+        raise ValueError(f'{name}={value} не найден')
+    return value
+
 
 def create_simple_model(file_data: csv.DictReader, model: models.Model):
     """Создание простой модели."""
-    model.objects.all().delete()
-    model.objects.bulk_create(
-        [
-            model(**row)
-            for row in file_data
-        ]
-    )
+    return (model(**row) for row in file_data)
 
 
 def create_recipe_model(file_data: csv.DictReader, model: Recipe):
     """Создание модели Recipe."""
-    model.objects.all().delete()
-    model.objects.bulk_create(
-        [
-            model(
-                id=row.get('id'),
-                name=row.get('name'),
-                author=User.objects.get(id=row.get('author_id')),
-                pub_date=row.get('pub_date'),
-                image=row.get('image'),
-                text=row.get('text'),
-                cooking_time=row.get('cooking_time')
-            )
-            for row in file_data
-        ]
+    user_ids = get_ids(User)
+    return (
+        model(
+            id=row.get('id'),
+            name=row.get('name'),
+            author_id=check_id(user_ids, row.get('author_id'), 'author_id'),
+            pub_date=row.get('pub_date'),
+            image=row.get('image'),
+            text=row.get('text'),
+            cooking_time=row.get('cooking_time')
+        )
+        for row in file_data
     )
 
 
 def create_recipe_tag_model(file_data: csv.DictReader, model: RecipeTag):
-    model.objects.all().delete()
-    model.objects.bulk_create(
-        [
-            model(
-                id=row.get('id'),
-                recipe=Recipe.objects.get(id=row.get('recipe_id')),
-                tag=Tag.objects.get(id=row.get('tag_id'))
-            )
-            for row in file_data
-        ]
+    recipe_ids = get_ids(Recipe)
+    tag_ids = get_ids(Tag)
+    return (
+        model(
+            id=row.get('id'),
+            recipe_id=check_id(recipe_ids, row.get('recipe_id'), 'recipe_id'),
+            tag_id=check_id(tag_ids, row.get('tag_id'), 'tag_id')
+        )
+        for row in file_data
     )
 
 
 def create_recipe_ingredient_model(
         file_data: csv.DictReader, model: RecipeIngredient):
-    model.objects.all().delete()
-    model.objects.bulk_create(
-        [
-            model(
-                id=row.get('id'),
-                recipe=Recipe.objects.get(id=row.get('recipe_id')),
-                ingredient=Ingredient.objects.get(id=row.get('ingredient_id')),
-                amount=row.get('amount')
-            )
-            for row in file_data
-        ]
+    recipe_ids = get_ids(Recipe)
+    ingredient_ids = get_ids(Ingredient)
+    return (
+        model(
+            id=row.get('id'),
+            recipe_id=check_id(recipe_ids, row.get('recipe_id'), 'recipe_id'),
+            ingredient_id=check_id(
+                ingredient_ids, row.get('ingredient_id'), 'ingredient_id'
+            ),
+            amount=row.get('amount')
+        )
+        for row in file_data
     )
 
 
 def create_follow_model(
         file_data: csv.DictReader, model: Follow):
-    model.objects.all().delete()
-    model.objects.bulk_create(
-        [
-            model(
-                id=row.get('id'),
-                user=User.objects.get(id=row.get('user_id')),
-                following=User.objects.get(id=row.get('following_id')),
-            )
-            for row in file_data
-        ]
+    user_ids = get_ids(User)
+    return (
+        model(
+            id=row.get('id'),
+            user_id=check_id(user_ids, row.get('user_id'), 'user_id'),
+            following_id=check_id(
+                user_ids, row.get('following_id'), 'following_id'
+            ),
+        )
+        for row in file_data
     )
 
 
 def create_favorite_model(
         file_data: csv.DictReader, model: Favorite):
-    model.objects.all().delete()
-    model.objects.bulk_create(
-        [
-            model(
-                id=row.get('id'),
-                user=User.objects.get(id=row.get('user_id')),
-                recipe=Recipe.objects.get(id=row.get('recipe_id')),
-            )
-            for row in file_data
-        ]
+    user_ids = get_ids(User)
+    recipe_ids = get_ids(Recipe)
+    return (
+        model(
+            id=row.get('id'),
+            user_id=check_id(user_ids, row.get('user_id'), 'user_id'),
+            recipe_id=check_id(recipe_ids, row.get('recipe_id'), 'recipe_id'),
+        )
+        for row in file_data
     )
 
 
 def create_user_model(
         file_data: csv.DictReader, model: User):
-    model.objects.all().delete()
-    model.objects.bulk_create(
-        [
-            model(
-                id=row.get('id'),
-                is_superuser=row.get('is_superuser'),
-                is_staff=row.get('is_staff'),
-                is_active=row.get('is_active'),
-                username=row.get('username'),
-                password=row.get('password'),
-                email=row.get('email'),
-                first_name=row.get('first_name'),
-                last_name=row.get('last_name')
-            )
-            for row in file_data
-        ]
+    return (
+        model(
+            id=row.get('id'),
+            is_superuser=row.get('is_superuser'),
+            is_staff=row.get('is_staff'),
+            is_active=row.get('is_active'),
+            username=row.get('username'),
+            password=row.get('password'),
+            email=row.get('email'),
+            first_name=row.get('first_name'),
+            last_name=row.get('last_name')
+        )
+        for row in file_data
     )
 
 
+def load_model(objects, model: models.Model, batch_size: int) -> int:
+    """Замена данных модели, объекты пишутся пачками по batch_size."""
+    model.objects.all().delete()
+    count = 0
+    while True:
+        batch = list(islice(objects, batch_size))
+        if not batch:
+            break
+        model.objects.bulk_create(batch, batch_size=batch_size)
+        count += len(batch)
+    return count
+
+
 class Command(BaseCommand):
     help = 'Загрузка данных из CSV файлов'
     link_models = (
@@ -138,7 +162,24 @@ class Command(BaseCommand):
         ('favorite.csv', Favorite, create_favorite_model),
     )
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help='Количество строк в одной пачке вставки'
+        )
+        parser.add_argument(
+            '--mode', choices=('auto', 'copy', 'bulk'), default='auto',
+            help='copy - COPY FROM STDIN (PostgreSQL), bulk - bulk_create, '
+                 'auto - copy если доступен'
+        )
+
     def handle(self, *args, **options):
+        use_copy = options['mode'] == 'copy' or (
+            options['mode'] == 'auto' and copy_supported()
+        )
+        if use_copy and not copy_supported():
+            raise CommandError('COPY поддерживается только для PostgreSQL')
+
         work_dir = Path(Path(settings.BASE_DIR).parent, 'data')
         with os.scandir(work_dir) as files:
             files = [file.name for file in files if file.is_file()
@@ -146,17 +187,63 @@ class Command(BaseCommand):
 
         print('загрузка данных из файла(ов):')
 
-        # будем грузить по порядку иначе будут проблемы
-        for file, model, func in self.link_models:
-            if file in files:
-                with open(Path(work_dir, file), encoding='utf-8') as h_file:
-                    file_reader = csv.DictReader(h_file, delimiter=',')
-                    print(f'{file} - ', end='')
-                    try:
-                        func(file_reader, model)
-                        print('\033[32m OK \033[0;0m')
-                    except Exception as err:
-                        print(err)
-                        print('\033[31m NO \033[0;0m')
-            else:
-                print(f'{file} - \033[31m NO \033[0;0m')
+        # все файлы грузим в одной транзакции, ошибка в файле
+        # откатывает только его изменения
+        with transaction.atomic(), counters.suspended(), \
+                shoplist.suspended():
+            # будем грузить по порядку иначе будут проблемы
+            for file, model, func in self.link_models:
+                if file in files:
+                    self.load_file(
+                        Path(work_dir, file), model,
+                        None if use_copy else func,
+                        options['batch_size']
+                    )
+                else:
+                    print(f'{file} - \033[31m NO \033[0;0m')
+
+            # в файлах явные id, последовательности нужно сдвинуть
+            reset_sequences(*(model for _, model, _ in self.link_models))
+            # счетчики при загрузке не ведутся, считаем заново
+            counters.recount(options['batch_size'])
+            shoplist.rebuild(
+                ShopList.objects.values_list('user_id', flat=True).distinct()
+            )
+
+        # вставка пачками идет без сигналов, кэши сбрасываем явно
+        for namespace in ('tags', 'ingredients', 'recipes'):
+            bump_version(namespace)
+
+    @staticmethod
+    def load_file(path, model, func, batch_size):
+        """Загрузка файла через COPY, либо через bulk_create если
+        передана функция создания объектов."""
+        with open(path, encoding='utf-8') as h_file:
+            print(f'{path.name} - ', end='')
+            start = time.perf_counter()
+            errors = []
+            try:
+                with transaction.atomic():
+                    if func is None:
+                        model.objects.all().delete()
+                        loader = CopyLoader(model)
+                        count = loader.load(h_file)
+                        errors = loader.errors
+                    else:
+                        file_reader = csv.DictReader(h_file, delimiter=',')
+                        count = load_model(
+                            func(file_reader, model), model, batch_size
+                        )
+            except Exception as err:
+                print(err)
+                print('\033[31m NO \033[0;0m')
+                return
+            elapsed = time.perf_counter() - start
+            print(
+                f'\033[32m OK \033[0;0m {count} строк за {elapsed:.2f} с '
+                f'({count / elapsed if elapsed else 0:.0f} строк/с)'
+            )
+            for error in errors[:MAX_REPORTED_ERRORS]:
+                print(f'    {error}')
+            if len(errors) > MAX_REPORTED_ERRORS:
+                print(f'    ... всего отброшено строк: {len(errors)}')
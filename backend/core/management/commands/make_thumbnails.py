@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core.images import make_variants
+from foods.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создание уменьшенных копий изображений существующих рецептов'
+
+    def handle(self, *args, **options):
+        names = Recipe.objects.exclude(image='').values_list(
+            'image', flat=True
+        ).distinct()
+        for name in names.iterator():
+            try:
+                make_variants(name)
+            except OSError as err:
+                self.stdout.write(f'{name} - {err}')
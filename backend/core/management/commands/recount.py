@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import recount
+from foods import shoplist
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчет счетчиков избранного, покупок, рецептов и подписчиков '
+        'и итогов списков покупок'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество записей в одной пачке пересчета'
+        )
+
+    def handle(self, *args, **options):
+        for counter, repaired in recount(options['batch_size']).items():
+            self.stdout.write(f'{counter}: исправлено {repaired}')
+        self.stdout.write(
+            'итоги списков покупок: исправлено пользователей '
+            f'{shoplist.repair(options["batch_size"])}'
+        )
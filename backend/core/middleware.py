@@ -0,0 +1,266 @@
+import asyncio
+import heapq
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+from rest_framework.serializers import BaseSerializer
+
+from .cache import digest, is_shared
+from .routers import choose_replica, use_replica
+
+# сколько групп повторяющихся запросов сохранять для запроса
+MAX_DUPLICATE_GROUPS = 5
+
+_profile = ContextVar('profile', default=None)
+
+
+class RequestProfile:
+    """Запросы к БД и время сериализации одного HTTP запроса."""
+
+    def __init__(self):
+        self.queries = {}
+        self.query_count = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # обертка connection.execute_wrapper
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.query_count += 1
+            self.db_time += elapsed
+            count, total = self.queries.get(sql, (0, 0.0))
+            self.queries[sql] = (count + 1, total + elapsed)
+
+    def duplicates(self):
+        """Одинаковый SQL, выполненный несколько раз, по убыванию."""
+        groups = [
+            {'sql': sql, 'count': count, 'time': round(total * 1000, 2)}
+            for sql, (count, total) in self.queries.items() if count > 1
+        ]
+        groups.sort(key=lambda group: group['count'], reverse=True)
+        return groups[:MAX_DUPLICATE_GROUPS]
+
+
+class SlowestRequests:
+    """Ограниченный набор самых медленных запросов процесса."""
+
+    def __init__(self, size):
+        self.size = size
+        self.heap = []
+        self.lock = threading.Lock()
+        self.counter = 0
+
+    def add(self, duration, entry):
+        with self.lock:
+            # счетчик разделяет записи с одинаковой длительностью
+            self.counter += 1
+            item = (duration, self.counter, entry)
+            if len(self.heap) < self.size:
+                heapq.heappush(self.heap, item)
+            elif duration > self.heap[0][0]:
+                heapq.heapreplace(self.heap, item)
+
+    def items(self):
+        with self.lock:
+            return [entry for _, _, entry in sorted(self.heap, reverse=True)]
+
+    def clear(self):
+        with self.lock:
+            self.heap.clear()
+
+
+slowest = SlowestRequests(settings.PROFILING_SLOWEST)
+
+
+def _timed_data(data):
+    """Свойство serializer.data с учетом времени в профиле запроса."""
+    def wrapper(serializer):
+        profile = _profile.get()
+        if profile is None:
+            return data.fget(serializer)
+        # вложенные .data учитываются во внешнем
+        profile.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            profile.serializer_depth -= 1
+            if not profile.serializer_depth:
+                profile.serializer_time += time.perf_counter() - start
+    wrapper.profiled = True
+    return property(wrapper)
+
+
+@contextmanager
+def profiled_connections():
+    """Учет запросов к БД текущего потока в профиле запроса.
+
+    execute_wrapper действует только на соединения потока, в котором
+    установлен: представления, выполняемые под ASGI в пуле потоков,
+    подключают профиль сами, он передается им в контексте.
+    """
+    profile = _profile.get()
+    with ExitStack() as stack:
+        if profile is not None:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+        yield
+
+
+class ProfilingMiddleware:
+    """Профилирование части запросов: количество и время запросов к БД,
+    повторяющийся SQL и время сериализации.
+
+    Включается настройкой PROFILING, доля профилируемых запросов -
+    PROFILING_SAMPLE_RATE. Результат отдается в заголовках
+    Server-Timing и X-Query-Count.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        if not getattr(BaseSerializer.data.fget, 'profiled', False):
+            BaseSerializer.data = _timed_data(BaseSerializer.data)
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _profile.set(profile)
+        start = time.perf_counter()
+        try:
+            with profiled_connections():
+                # запросы потоковых ответов выполняются уже после
+                # выхода из middleware и не учитываются
+                response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+        total = time.perf_counter() - start
+
+        response['X-Query-Count'] = str(profile.query_count)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={profile.db_time * 1000:.2f};'
+            f'desc="{profile.query_count} queries"',
+            f'serializer;dur={profile.serializer_time * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ))
+        slowest.add(total, {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'time': round(total * 1000, 2),
+            'db_time': round(profile.db_time * 1000, 2),
+            'serializer_time': round(profile.serializer_time * 1000, 2),
+            'query_count': profile.query_count,
+            'duplicates': profile.duplicates(),
+        })
+        return response
+
+
+class AsgiUrlconfMiddleware:
+    """Адреса с асинхронными представлениями при запуске через ASGI.
+
+    Под WSGI адреса не меняются.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if isinstance(request, ASGIRequest):
+            request.urlconf = settings.ASGI_URLCONF
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+
+class ReplicaMiddleware:
+    """Чтение с реплик для безопасных запросов к API.
+
+    После успешного изменяющего запроса клиент с тем же заголовком
+    Authorization REPLICA_STICKY_SECONDS секунд читает с основной БД,
+    пока изменения доходят до реплик. Отметка об изменении хранится в
+    кэше и должна быть видна всем процессам сервера.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REPLICA_DATABASES:
+            raise MiddlewareNotUsed
+        if not is_shared():
+            raise ImproperlyConfigured(
+                'DB_REPLICAS требует общего для процессов кэша: с '
+                'локальным кэшем после изменения другой процесс прочитает '
+                'устаревшие данные с реплики'
+            )
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    @staticmethod
+    def sticky_key(request):
+        authorization = request.headers.get('Authorization')
+        if authorization:
+            return f'primary:{digest(authorization)}'
+        return None
+
+    def get_alias(self, request):
+        """Реплика для запроса или None для основной БД."""
+        if (
+            request.method not in ('GET', 'HEAD', 'OPTIONS')
+            or not request.path_info.startswith('/api/')
+        ):
+            return None
+        key = self.sticky_key(request)
+        if key is not None and cache.get(key):
+            return None
+        return choose_replica()
+
+    def written(self, request, response):
+        key = self.sticky_key(request)
+        if (
+            key is not None
+            and request.method not in ('GET', 'HEAD', 'OPTIONS')
+            and response.status_code < 400
+        ):
+            cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with use_replica(self.get_alias(request)):
+            response = self.get_response(request)
+        self.written(request, response)
+        return response
+
+    async def __acall__(self, request):
+        alias = await sync_to_async(self.get_alias)(request)
+        with use_replica(alias):
+            response = await self.get_response(request)
+        await sync_to_async(self.written)(request, response)
+        return response
@@ -1,4 +1,12 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 from core.constants import PAGE_SIZE
 
@@ -7,3 +15,133 @@ class PageLimitPagination(PageNumberPagination):
     """Custom pagination."""
     page_size = PAGE_SIZE
     page_size_query_param = 'limit'
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по значениям ключа сортировки последней записи.
+
+    Вместо OFFSET и COUNT(*) следующая страница выбирается условием
+    "после записи курсора", что при наличии индекса по ключу сортировки
+    стоит одинаково для любой глубины.
+    """
+    cursor_query_param = 'cursor'
+    page_size = PAGE_SIZE
+    page_size_query_param = 'limit'
+    invalid_cursor_message = 'Некорректный курсор'
+    # ключ сортировки: (поле, по убыванию), последнее поле уникально
+    ordering = ()
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    def encode_cursor(self, obj, reverse):
+        if isinstance(obj, dict):
+            # строка values(): модель только с полями ключа
+            obj = self.model(**{name: obj[name] for name, _ in self.ordering})
+        opts = obj._meta
+        values = [
+            opts.get_field(name).value_to_string(obj)
+            for name, _ in self.ordering
+        ]
+        cursor = json.dumps({'v': values, 'r': reverse})
+        return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+    def decode_cursor(self, model, cursor):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = [
+                model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(self.ordering, data['v'])
+            ]
+            return values, bool(data['r'])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def position_filter(self, values, reverse):
+        """Условие "строго после позиции" для составного ключа."""
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(self.ordering, values):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.model = queryset.model
+        self.page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+
+        reverse = False
+        if cursor:
+            values, reverse = self.decode_cursor(queryset.model, cursor)
+            queryset = queryset.filter(self.position_filter(values, reverse))
+
+        order_by = [
+            f'{"-" if descending != reverse else ""}{name}'
+            for name, descending in self.ordering
+        ]
+        results = list(queryset.order_by(*order_by)[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        # при движении назад "еще записи" находятся в начале страницы
+        has_next = has_more if not reverse else bool(cursor)
+        has_previous = bool(cursor) if not reverse else has_more
+        self.next_cursor = (
+            self.encode_cursor(results[-1], False)
+            if has_next and results else None
+        )
+        self.previous_cursor = (
+            self.encode_cursor(results[0], True)
+            if has_previous and results else None
+        )
+        return results
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, cursor
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.next_cursor),
+            'previous': self.get_link(self.previous_cursor),
+            'results': data,
+        })
+
+
+class RecipeKeysetPagination(KeysetPagination):
+    """Ключ - сортировка Recipe.Meta.ordering и id для однозначности."""
+    ordering = (('pub_date', True), ('name', False), ('id', False))
+
+
+class RecipePagination(PageLimitPagination):
+    """Номера страниц по умолчанию, по ключу - если передан cursor.
+
+    Результаты полнотекстового поиска упорядочены по релевантности,
+    для них cursor игнорируется.
+    """
+    keyset_class = RecipeKeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if (self.keyset_class.cursor_query_param in request.query_params
+                and 'search_rank' not in queryset.query.annotations):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,52 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# модели, которые всегда читаются с основной БД: новый токен после
+# входа мог еще не дойти до реплики
+PRIMARY_MODELS = {'authtoken.token'}
+
+_replica = ContextVar('replica', default=None)
+
+
+def choose_replica():
+    return random.choice(settings.REPLICA_DATABASES)
+
+
+@contextmanager
+def use_replica(alias):
+    """Чтение с реплики alias внутри блока, None - с основной БД."""
+    token = _replica.set(alias)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def primary():
+    return use_replica(None)
+
+
+class ReplicaRouter:
+    """Чтение с реплики, выбранной для запроса ReplicaMiddleware.
+
+    Вне запроса и для изменяющих запросов используется основная БД.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias is None or model._meta.label_lower in PRIMARY_MODELS:
+            return 'default'
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # объект, прочитанный с реплики, сохраняется в основную БД
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,40 @@
+import shutil
+import tempfile
+
+from django.db import connections
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+# вторая БД для тестов чтения с реплик - зеркало основной тестовой БД
+REPLICA_ALIAS = 'replica_test'
+
+
+class TestRunner(DiscoverRunner):
+    """Тесты с файловым кэшем во временном каталоге и репликой.
+
+    Общий кэш запущенного сервера тесты не читают и не меняют.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_dir = tempfile.mkdtemp(prefix='foodgram_test_cache')
+        self.cache_settings = override_settings(CACHES={
+            'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': self.cache_dir,
+            }
+        })
+        self.cache_settings.enable()
+        connections.settings[REPLICA_ALIAS] = {
+            **connections.settings['default'],
+            'TEST': {'MIRROR': 'default'},
+        }
+
+    def teardown_test_environment(self, **kwargs):
+        connections[REPLICA_ALIAS].close()
+        del connections[REPLICA_ALIAS]
+        del connections.settings[REPLICA_ALIAS]
+        self.cache_settings.disable()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
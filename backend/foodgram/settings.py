@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from django.core.management.utils import get_random_secret_key
@@ -33,6 +34,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.AsgiUrlconfMiddleware',
+    'core.middleware.ProfilingMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -44,6 +48,9 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'foodgram.urls'
 
+# адреса при запуске через ASGI (uvicorn)
+ASGI_URLCONF = 'foodgram.asgi_urls'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -69,6 +76,9 @@ if DB_SQL:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'bd/db.sqlite3',
+            # тестовая БД в файле, а не в памяти: тесты параллельных
+            # запросов работают с ней из нескольких потоков
+            'TEST': {'NAME': BASE_DIR / 'bd/test.sqlite3'},
         }
     }
 else:
@@ -83,6 +93,51 @@ else:
         }
     }
 
+# реплики только для чтения через запятую: хосты PostgreSQL или,
+# при DB_SQL, файлы SQLite
+REPLICA_DATABASES = []
+for number, replica in enumerate(filter(None, os.getenv(
+    'DB_REPLICAS', ''
+).split(','))):
+    alias = f'replica_{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME' if DB_SQL else 'HOST': replica,
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+# сколько секунд после изменения данных клиент читает с основной БД
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+# кэш общий для всех процессов сервера и команд manage.py: версии
+# данных, сменившиеся в одном процессе, должны видеть остальные.
+# По умолчанию - файлы в общем временном каталоге, для нескольких
+# машин - memcached или redis
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram_cache')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+        },
+    }
+}
+
+# тесты используют отдельный кэш
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+# время (сек.) в Cache-Control для справочников: тэги, ингредиенты
+REFERENCE_CACHE_MAX_AGE = int(os.getenv('REFERENCE_CACHE_MAX_AGE', 60))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -120,16 +175,37 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 AUTH_USER_MODEL = 'users.User'
 
+# уменьшенные копии изображений рецептов: название - наибольшая сторона, px
+IMAGE_VARIANTS = {
+    'small': 300,
+    'medium': 600,
+}
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 6000))
+# потоки для создания копий изображений вне запроса
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',
     ],
     'PAGE_SIZE': 6,
 }
 
+# профилирование запросов: доля профилируемых запросов от 0 до 1 и
+# сколько самых медленных хранить для /api/_debug/profile/
+PROFILING = os.getenv('PROFILING', False) == 'True'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 1))
+PROFILING_SLOWEST = int(os.getenv('PROFILING_SLOWEST', 50))
+
+# время (сек.) хранения пользователя по токену в кэше аутентификации
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 300))
+
+# ограничение количества ингредиентов в ответе на поиск, 0 - без ограничения
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 0))
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
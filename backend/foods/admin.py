@@ -78,7 +78,7 @@ class RecipeAdmin(admin.ModelAdmin):
 
     @admin.display(description='Кол-во в избр.')
     def get_count(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
     @admin.display(description='Миниатюра')
     def get_html_photo(self, obj):
@@ -0,0 +1,75 @@
+import threading
+from bisect import bisect_left
+
+from core.cache import get_version
+from core.routers import primary
+from .models import Ingredient
+
+
+def normalize(value):
+    """Приведение названия к виду для сравнения (регистр, ё/е)."""
+    return value.casefold().replace('ё', 'е')
+
+
+class IngredientPrefixIndex:
+    """Индекс ингредиентов в памяти процесса для поиска по началу названия.
+
+    Индекс построен для версии 'ingredients' общего кэша. Версию меняют
+    после фиксации сигналы ингредиентов, loadcsv и generate_data в любом
+    процессе, поиск сравнивает ее с версией индекса и перестраивает его.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (версия, ключи, ингредиенты) - публикуются вместе одной ссылкой
+        self._data = (None, [], [])
+
+    def mark_stale(self):
+        """Сброс индекса процесса, следующий поиск построит его заново."""
+        self._data = (None, [], [])
+
+    def _build(self, version):
+        # по основной БД: реплика могла еще не получить изменение,
+        # сменившее версию
+        with primary():
+            rows = sorted(
+                (normalize(name), name, unit, pk)
+                for pk, name, unit in Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit'
+                )
+            )
+        keys = [row[0] for row in rows]
+        items = [
+            Ingredient(id=pk, name=name, measurement_unit=unit)
+            for _, name, unit, pk in rows
+        ]
+        # одно присваивание: поиск в других потоках видит либо старые,
+        # либо новые списки
+        self._data = (version, keys, items)
+
+    def _current(self):
+        version = get_version('ingredients')
+        data = self._data
+        if data[0] == version:
+            return data
+        with self._lock:
+            if self._data[0] != version:
+                # версия прочитана до чтения из БД: изменение во время
+                # построения сменит ее, и индекс построится снова
+                self._build(version)
+            return self._data
+
+    def search(self, prefix, limit=None):
+        """Ингредиенты, название которых начинается с prefix."""
+        _, keys, items = self._current()
+        prefix = normalize(prefix)
+        result = []
+        for position in range(bisect_left(keys, prefix), len(keys)):
+            if not keys[position].startswith(prefix):
+                break
+            if limit and len(result) >= limit:
+                break
+            result.append(items[position])
+        return result
+
+
+ingredient_index = IngredientPrefixIndex()
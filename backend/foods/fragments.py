@@ -0,0 +1,75 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from core.cache import bump_version, get_versions
+from core.routers import primary
+
+FRAGMENT_KEY = 'recipe-fragment:{}:{}'
+
+
+def recipe_namespace(recipe_id) -> str:
+    return f'recipe:{recipe_id}'
+
+
+def author_namespace(author_id) -> str:
+    return f'author:{author_id}'
+
+
+def bump_recipes(recipe_ids):
+    """Смена версий рецептов после фиксации транзакции."""
+    recipe_ids = set(recipe_ids)
+
+    def bump():
+        for recipe_id in recipe_ids:
+            bump_version(recipe_namespace(recipe_id))
+    transaction.on_commit(bump)
+
+
+def bump_author(author_id):
+    transaction.on_commit(
+        lambda: bump_version(author_namespace(author_id))
+    )
+
+
+def fragment_keys(rows) -> dict:
+    """Ключи кэша {id рецепта: ключ} по строкам с id и author_id.
+
+    В ключ входят версии рецепта, его автора, тэгов и ингредиентов.
+    """
+    namespaces = {'tags', 'ingredients'}
+    for row in rows:
+        namespaces.add(recipe_namespace(row['id']))
+        namespaces.add(author_namespace(row['author_id']))
+    versions = get_versions(namespaces)
+    common = f'{versions["tags"]}:{versions["ingredients"]}'
+    return {
+        row['id']: FRAGMENT_KEY.format(row['id'], ':'.join((
+            str(versions[recipe_namespace(row['id'])]),
+            str(versions[author_namespace(row['author_id'])]),
+            common,
+        )))
+        for row in rows
+    }
+
+
+def get_fragments(rows, build) -> dict:
+    """Общие для всех пользователей части ответа {id рецепта: данные}.
+
+    Отсутствующие в кэше строит build(ids) по основной БД: реплика
+    могла еще не получить изменение, сменившее версию. Рецепты,
+    удаленные за время запроса, в результат не попадают.
+    """
+    keys = fragment_keys(rows)
+    cached = cache.get_many(keys.values())
+    fragments = {
+        recipe_id: cached[key]
+        for recipe_id, key in keys.items() if key in cached
+    }
+    missing = [recipe_id for recipe_id in keys if recipe_id not in fragments]
+    if missing:
+        with primary():
+            built = build(missing)
+        cache.set_many({keys[recipe_id]: fragment
+                        for recipe_id, fragment in built.items()})
+        fragments.update(built)
+    return fragments
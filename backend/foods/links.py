@@ -0,0 +1,155 @@
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from core import counters
+from users.models import User
+from . import shoplist
+from .models import Recipe, ShopList
+
+# поля рецепта для ответа о добавлении
+RECIPE_FIELDS = ('id', 'name', 'image', 'cooking_time')
+
+
+def lock_user(user_id: int):
+    """Блокировка строки пользователя до конца транзакции.
+
+    Удаления и добавление пакетом без RETURNING выполняются
+    последовательно: учет ведется только по действительно добавленным
+    и удаленным строкам. Добавлению с RETURNING блокировка не нужна,
+    вставленные строки возвращает сама команда.
+    """
+    users = User.objects.filter(pk=user_id)
+    if connection.features.has_select_for_update:
+        list(users.select_for_update().values_list('pk'))
+    else:
+        # SQLite блокирует на запись всю БД: блокировку берем сразу,
+        # повысить ее после чтения в транзакции нельзя
+        users.update(id=F('id'))
+
+
+def returning_supported() -> bool:
+    """Поддержка INSERT ... ON CONFLICT DO NOTHING RETURNING."""
+    if connection.vendor == 'postgresql':
+        return True
+    return (
+        connection.vendor == 'sqlite'
+        and connection.Database.sqlite_version_info >= (3, 35)
+    )
+
+
+def insert_sql(model, user_id: int, recipe_ids, allow_own: bool):
+    """INSERT ... SELECT связей с рецептами, автор проверяется в нем же.
+
+    Повторная или параллельная вставка той же связи ничего не делает,
+    RETURNING отдает id только добавленных рецептов.
+    """
+    quote = connection.ops.quote_name
+    params = [user_id, *recipe_ids]
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    own = ''
+    if not allow_own:
+        own = 'AND r.author_id <> %s'
+        params.append(user_id)
+    sql = (
+        f'INSERT INTO {quote(model._meta.db_table)} (user_id, recipe_id) '
+        f'SELECT %s, r.id FROM {quote(Recipe._meta.db_table)} r '
+        f'WHERE r.id IN ({placeholders}) {own} '
+        'ON CONFLICT (user_id, recipe_id) DO NOTHING '
+        'RETURNING recipe_id'
+    )
+    return sql, params
+
+
+def insert(model, user_id: int, recipe_id: int, allow_own: bool):
+    """Вставка связи одной командой.
+
+    Возвращает рецепт, если строка добавлена, иначе None.
+    """
+    quote = connection.ops.quote_name
+    sql, params = insert_sql(model, user_id, [recipe_id], allow_own)
+    columns = ', '.join(f'r.{quote(name)}' for name in RECIPE_FIELDS)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # данные рецепта для ответа - в том же запросе
+            cursor.execute(
+                f'WITH added AS ({sql}) SELECT {columns} FROM added '
+                f'JOIN {quote(Recipe._meta.db_table)} r '
+                'ON r.id = added.recipe_id',
+                params
+            )
+            row = cursor.fetchone()
+            return Recipe(**dict(zip(RECIPE_FIELDS, row))) if row else None
+        cursor.execute(sql, params)
+        if cursor.fetchone() is None:
+            return None
+    return Recipe.objects.only(*RECIPE_FIELDS).get(pk=recipe_id)
+
+
+def create(model, user_id: int, recipe_id: int, allow_own: bool):
+    """Добавление через ORM для БД без RETURNING, учет - по сигналам."""
+    recipe = Recipe.objects.only(*RECIPE_FIELDS, 'author_id').filter(
+        pk=recipe_id
+    ).first()
+    if recipe is None or (not allow_own and recipe.author_id == user_id):
+        return None
+    try:
+        with transaction.atomic():
+            model.objects.create(user_id=user_id, recipe_id=recipe_id)
+    except IntegrityError:
+        return None
+    return recipe
+
+
+@transaction.atomic
+def add(model, user_id: int, recipe_id: int, allow_own: bool = True):
+    """Добавление рецепта в избранное или список покупок.
+
+    Возвращает рецепт или None, если рецепта нет, он свой
+    (allow_own=False) или уже добавлен.
+    """
+    if not returning_supported():
+        return create(model, user_id, recipe_id, allow_own)
+    recipe = insert(model, user_id, recipe_id, allow_own)
+    if recipe is not None:
+        added(model, user_id, [recipe_id])
+    return recipe
+
+
+def added(model, user_id: int, recipe_ids):
+    """Учет связей, добавленных в обход ORM: сигналы не отправлялись."""
+    counters.related_created(
+        model, [model(user_id=user_id, recipe_id=pk) for pk in recipe_ids]
+    )
+    if model is ShopList:
+        shoplist.apply_recipes(user_id, recipe_ids, 1)
+
+
+@transaction.atomic
+def add_many(model, user_id: int, recipe_ids, allow_own: bool = True):
+    """Добавление рецептов пакетом одним INSERT.
+
+    Возвращает множество id действительно добавленных рецептов: уже
+    добавленные, в том числе параллельным запросом, несуществующие и
+    свои (allow_own=False) в него не входят.
+    """
+    if returning_supported():
+        sql, params = insert_sql(model, user_id, recipe_ids, allow_own)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            created = [row[0] for row in cursor.fetchall()]
+    else:
+        # без RETURNING добавленные строки не узнать, пакеты одного
+        # пользователя выполняются последовательно
+        lock_user(user_id)
+        recipes = Recipe.objects.filter(pk__in=recipe_ids).exclude(
+            pk__in=model.objects.filter(user_id=user_id).values('recipe_id')
+        )
+        if not allow_own:
+            recipes = recipes.exclude(author_id=user_id)
+        created = list(recipes.values_list('pk', flat=True))
+        model.objects.bulk_create(
+            [model(user_id=user_id, recipe_id=pk) for pk in created]
+        )
+    if created:
+        added(model, user_id, created)
+    return set(created)
@@ -0,0 +1,70 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_totals(apps, schema_editor):
+    RecipeIngredient = apps.get_model('foods', 'RecipeIngredient')
+    ShopListIngredient = apps.get_model('foods', 'ShopListIngredient')
+    ShopListIngredient.objects.bulk_create(
+        ShopListIngredient(
+            user_id=row['recipe__shoplists__user'],
+            ingredient_id=row['ingredient'],
+            total_amount=row['total_amount'],
+            recipe_count=row['recipe_count']
+        )
+        for row in RecipeIngredient.objects.filter(
+            recipe__shoplists__isnull=False
+        ).values(
+            'recipe__shoplists__user', 'ingredient'
+        ).annotate(
+            total_amount=Sum('amount'),
+            recipe_count=Count('recipe')
+        ).order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0002_counters'),
+        ('foods', '0004_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopListVersion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='shoplist_version', serialize=False, to='users.user', verbose_name='Пользователь')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия списка покупок',
+                'verbose_name_plural': 'Версии списков покупок',
+            },
+        ),
+        migrations.CreateModel(
+            name='ShopListIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.PositiveIntegerField(verbose_name='Количество')),
+                ('recipe_count', models.PositiveIntegerField(verbose_name='Кол-во рецептов')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shoplist_ingredients', to='foods.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shoplist_ingredients', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Итог списка покупок',
+                'verbose_name_plural': 'Итоги списков покупок',
+                'ordering': ('user',),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoplistingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique shoplist ingredient'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+from django.db import migrations
+
+PG_FORWARD = (
+    "ALTER TABLE foods_recipe ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(text, '')), 'B')"
+    ") STORED",
+    'CREATE INDEX recipe_search_idx ON foods_recipe '
+    'USING GIN (search_vector)',
+)
+PG_REVERSE = (
+    'DROP INDEX IF EXISTS recipe_search_idx',
+    'ALTER TABLE foods_recipe DROP COLUMN IF EXISTS search_vector',
+)
+
+SQLITE_FORWARD = (
+    'CREATE VIRTUAL TABLE foods_recipe_fts USING fts5('
+    "name, text, content='foods_recipe', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    """CREATE TRIGGER foods_recipe_fts_ai
+    AFTER INSERT ON foods_recipe BEGIN
+        INSERT INTO foods_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END""",
+    """CREATE TRIGGER foods_recipe_fts_ad
+    AFTER DELETE ON foods_recipe BEGIN
+        INSERT INTO foods_recipe_fts(foods_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END""",
+    """CREATE TRIGGER foods_recipe_fts_au
+    AFTER UPDATE OF name, text ON foods_recipe BEGIN
+        INSERT INTO foods_recipe_fts(foods_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO foods_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END""",
+    "INSERT INTO foods_recipe_fts(foods_recipe_fts) VALUES ('rebuild')",
+)
+SQLITE_REVERSE = (
+    'DROP TRIGGER IF EXISTS foods_recipe_fts_ai',
+    'DROP TRIGGER IF EXISTS foods_recipe_fts_ad',
+    'DROP TRIGGER IF EXISTS foods_recipe_fts_au',
+    'DROP TABLE IF EXISTS foods_recipe_fts',
+)
+
+
+def run_for_vendor(statements):
+    """Выполнение SQL, соответствующего используемой БД."""
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(sql, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0006_recipetag_tag_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(
+                {'postgresql': PG_FORWARD, 'sqlite': SQLITE_FORWARD}
+            ),
+            run_for_vendor(
+                {'postgresql': PG_REVERSE, 'sqlite': SQLITE_REVERSE}
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0007_recipe_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSearch',
+            fields=[
+                ('recipe', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='foods.recipe')),
+            ],
+            options={
+                'db_table': 'foods_recipe_fts',
+                'managed': False,
+            },
+        ),
+    ]
@@ -106,11 +106,27 @@ class Recipe(BaseName):
         help_text='Тег',
         through='RecipeTag'
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Кол-во в избранном',
+        default=0,
+        editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='Кол-во в списках покупок',
+        default=0,
+        editable=False
+    )
 
     class Meta(BaseName.Meta):
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date', 'name',)
+        indexes = [
+            # ключ постраничного вывода ленты по курсору
+            models.Index(
+                fields=('-pub_date', 'name', 'id'), name='recipe_feed_idx'
+            ),
+        ]
 
 
 class RecipeTag(models.Model):
@@ -132,6 +148,10 @@ class RecipeTag(models.Model):
         constraints = [
             UniqueConstraint(fields=['recipe', 'tag'], name='unique tag')
         ]
+        indexes = [
+            # фильтр рецептов по тэгам
+            models.Index(fields=('tag', 'recipe'), name='recipetag_tag_idx'),
+        ]
         verbose_name = 'Рецепт, Тэг'
         verbose_name_plural = 'Рецепт, Тэги'
         ordering = ('recipe',)
@@ -222,3 +242,78 @@ class ShopList(models.Model):
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списоки покупок'
         ordering = ('user', 'recipe',)
+
+
+class ShopListIngredient(models.Model):
+    """Итог по ингредиенту в списке покупок пользователя.
+
+    Поддерживается при изменении списка покупок и состава рецептов,
+    чтобы выгрузка списка была одним чтением по индексу.
+    """
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='shoplist_ingredients'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+        related_name='shoplist_ingredients'
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name='Количество'
+    )
+    recipe_count = models.PositiveIntegerField(
+        verbose_name='Кол-во рецептов'
+    )
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique shoplist ingredient'
+            )
+        ]
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        ordering = ('user',)
+
+
+class ShopListVersion(models.Model):
+    """Версия итогов списка покупок пользователя."""
+    user = models.OneToOneField(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='shoplist_version'
+    )
+    version = models.PositiveIntegerField(
+        verbose_name='Версия',
+        default=0
+    )
+
+    class Meta:
+        verbose_name = 'Версия списка покупок'
+        verbose_name_plural = 'Версии списков покупок'
+
+
+class RecipeSearch(models.Model):
+    """Строка индекса FTS5 рецептов SQLite (foods.search).
+
+    Таблицу создает миграция 0007 только в SQLite, модель нужна, чтобы
+    присоединять индекс к рецептам одним JOIN.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        related_name='search_index'
+    )
+
+    class Meta:
+        managed = False
+        db_table = 'foods_recipe_fts'
@@ -0,0 +1,112 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+# конфигурация полнотекстового поиска PostgreSQL
+PG_CONFIG = 'russian'
+# веса bm25 для колонок name, text индекса SQLite
+FTS_WEIGHTS = '10.0, 1.0'
+FTS_TABLE = 'foods_recipe_fts'
+
+SQLITE_FTS_TRIGGERS = (
+    f"""CREATE TRIGGER IF NOT EXISTS foods_recipe_fts_ai
+    AFTER INSERT ON foods_recipe BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS foods_recipe_fts_ad
+    AFTER DELETE ON foods_recipe BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS foods_recipe_fts_au
+    AFTER UPDATE OF name, text ON foods_recipe BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END""",
+)
+
+
+def ensure_sqlite_fts(using='default', **kwargs):
+    """Восстановление триггеров индекса SQLite.
+
+    Миграции SQLite пересоздают таблицу рецептов при изменении ее
+    структуры, триггеры при этом теряются, индекс перестраивается.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'table' "
+            'AND name = %s', [FTS_TABLE]
+        )
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' "
+            'AND tbl_name = %s', ['foods_recipe']
+        )
+        if cursor.fetchone()[0] == len(SQLITE_FTS_TRIGGERS):
+            return
+        for sql in SQLITE_FTS_TRIGGERS:
+            cursor.execute(sql)
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+        )
+
+
+def fts_query(query):
+    """Запрос FTS5: все слова, каждое как префикс."""
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_recipes(queryset, query):
+    """Рецепты, подходящие под запрос, по убыванию релевантности.
+
+    PostgreSQL - tsvector колонка search_vector с GIN индексом,
+    SQLite - внешняя таблица FTS5, прочие БД - поиск подстроки.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        tsquery = f"websearch_to_tsquery('{PG_CONFIG}', %s)"
+        queryset = queryset.annotate(
+            search_match=RawSQL(
+                f'"foods_recipe"."search_vector" @@ {tsquery}',
+                [query], output_field=BooleanField()
+            ),
+            search_rank=RawSQL(
+                f'ts_rank("foods_recipe"."search_vector", {tsquery})',
+                [query], output_field=FloatField()
+            ),
+        ).filter(search_match=True)
+    elif vendor == 'sqlite':
+        match = fts_query(query)
+        if not match:
+            return queryset.none()
+        # индекс присоединяется одним JOIN: MATCH выполняется один раз,
+        # bm25 считается для каждой найденной строки
+        queryset = queryset.filter(
+            search_index__isnull=False
+        ).filter(RawSQL(
+            f'"{FTS_TABLE}" MATCH %s', [match], output_field=BooleanField()
+        )).annotate(
+            search_rank=RawSQL(
+                f'-bm25("{FTS_TABLE}", {FTS_WEIGHTS})', [],
+                output_field=FloatField()
+            ),
+        )
+    else:
+        queryset = queryset.filter(
+            Q(name__icontains=query) | Q(text__icontains=query)
+        ).annotate(
+            search_rank=RawSQL('0', [], output_field=FloatField())
+        )
+    return queryset.order_by(
+        '-search_rank', *queryset.model._meta.ordering
+    )
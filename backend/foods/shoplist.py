@@ -0,0 +1,268 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from .models import (Recipe, RecipeIngredient, ShopList, ShopListIngredient,
+                     ShopListVersion)
+
+_state = threading.local()
+
+
+def is_suspended():
+    return getattr(_state, 'suspended', False)
+
+
+@contextmanager
+def suspended():
+    """Отключение учета по сигналам на время массовой загрузки."""
+    previous = is_suspended()
+    _state.suspended = True
+    try:
+        yield
+    finally:
+        _state.suspended = previous
+
+
+class _TransactionMark:
+    """Обработчик on_commit без действия - отметка транзакции."""
+
+    def __call__(self):
+        pass
+
+
+def _in_transaction(mark):
+    # отметка ждет фиксации: при откате транзакции или точки сохранения
+    # Django убирает ее из списка on_commit, при фиксации - выполняет
+    return any(
+        func is mark for _, func in transaction.get_connection().run_on_commit
+    )
+
+
+def _deleting_state():
+    state = getattr(_state, 'deleting', None)
+    if state is None or not _in_transaction(state[0]):
+        state = None, {'user': set(), 'recipe': set()}
+        _state.deleting = state
+    return state
+
+
+def deleting(kind):
+    """id записей вида kind ('user', 'recipe'), удаляемых в данный момент.
+
+    Каскадное удаление рецепта или пользователя удаляет строки списка
+    покупок и состава рецепта в произвольном порядке, такие изменения
+    учитываются пересчетом после удаления. Отметки действуют до конца
+    транзакции: удаление, прерванное исключением между pre_delete и
+    post_delete, не оставляет их в потоке.
+    """
+    return _deleting_state()[1][kind]
+
+
+def mark_deleting(kind, pk):
+    mark, ids = _deleting_state()
+    if mark is None:
+        mark = _TransactionMark()
+        transaction.on_commit(mark)
+        _state.deleting = mark, ids
+    ids[kind].add(pk)
+
+
+@contextmanager
+def recipes_update():
+    """Отложенный пересчет: изменения состава рецептов внутри блока
+    учитываются одним пересчетом при выходе."""
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        yield
+        return
+    _state.pending = set()
+    try:
+        yield
+        recipe_ids = _state.pending
+    finally:
+        _state.pending = None
+    if recipe_ids:
+        recipes_changed(recipe_ids)
+
+
+def lock_recipes(recipe_ids, share=False):
+    """Блокировка строк рецептов до конца транзакции.
+
+    Добавление рецепта в список покупок (share=True) и пересчет после
+    изменения его состава выполняются один после другого: иначе итоги
+    получат старое количество или пересчет не увидит новую строку
+    списка покупок. SQLite блокирует на запись всю БД.
+    """
+    if connection.vendor != 'postgresql' or not recipe_ids:
+        return
+    mode = 'FOR SHARE' if share else 'FOR NO KEY UPDATE'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT id FROM {Recipe._meta.db_table} '
+            f'WHERE id = ANY(%s) ORDER BY id {mode}',
+            [sorted(set(recipe_ids))]
+        )
+
+
+def lock_versions(user_ids):
+    """Блокировка версий пользователей, изменения одного списка покупок
+    выполняются последовательно."""
+    ShopListVersion.objects.bulk_create(
+        [ShopListVersion(user_id=user_id) for user_id in user_ids],
+        ignore_conflicts=True
+    )
+    list(
+        ShopListVersion.objects.select_for_update().filter(
+            user_id__in=user_ids
+        ).order_by('user_id').values_list('user_id')
+    )
+
+
+def bump_versions(user_ids):
+    ShopListVersion.objects.filter(user_id__in=user_ids).update(
+        version=F('version') + 1
+    )
+
+
+def get_version(user_id):
+    return ShopListVersion.objects.filter(user_id=user_id).values_list(
+        'version', flat=True
+    ).first() or 0
+
+
+@transaction.atomic
+def apply_recipes(user_id, recipe_ids, sign=1):
+    """Добавление (sign=1) или вычитание (sign=-1) рецептов из итогов."""
+    # состав читается после блокировок: параллельное изменение рецепта
+    # успевает зафиксироваться или ждет окончания этой транзакции
+    lock_recipes(recipe_ids, share=True)
+    lock_versions([user_id])
+    amounts = {}
+    counts = {}
+    for ingredient_id, amount in RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('ingredient_id', 'amount'):
+        amounts[ingredient_id] = amounts.get(ingredient_id, 0) + amount
+        counts[ingredient_id] = counts.get(ingredient_id, 0) + 1
+
+    if amounts:
+        totals = ShopListIngredient.objects.filter(
+            user_id=user_id, ingredient_id__in=amounts
+        )
+        existing = set(totals.values_list('ingredient_id', flat=True))
+        if existing:
+            total_amount = F('total_amount') + Case(
+                *(When(ingredient_id=pk, then=Value(sign * amounts[pk]))
+                  for pk in existing)
+            )
+            recipe_count = F('recipe_count') + Case(
+                *(When(ingredient_id=pk, then=Value(sign * counts[pk]))
+                  for pk in existing)
+            )
+            if sign < 0:
+                total_amount = Greatest(total_amount, 0)
+                recipe_count = Greatest(recipe_count, 0)
+            totals.filter(ingredient_id__in=existing).update(
+                total_amount=total_amount, recipe_count=recipe_count
+            )
+        if sign > 0:
+            ShopListIngredient.objects.bulk_create([
+                ShopListIngredient(
+                    user_id=user_id,
+                    ingredient_id=pk,
+                    total_amount=amount,
+                    recipe_count=counts[pk]
+                )
+                for pk, amount in amounts.items() if pk not in existing
+            ])
+        else:
+            totals.filter(recipe_count=0).delete()
+    bump_versions([user_id])
+
+
+def totals(user_ids):
+    """Итоги пользователей по спискам покупок:
+    {(id пользователя, id ингредиента): (количество, кол-во рецептов)}."""
+    return {
+        (row['recipe__shoplists__user'], row['ingredient']): (
+            row['total_amount'], row['recipe_count']
+        )
+        for row in RecipeIngredient.objects.filter(
+            recipe__shoplists__user__in=user_ids
+        ).values(
+            'recipe__shoplists__user', 'ingredient'
+        ).annotate(
+            total_amount=Sum('amount'),
+            recipe_count=Count('recipe')
+        ).order_by()
+    }
+
+
+@transaction.atomic
+def rebuild(user_ids):
+    """Полный пересчет итогов пользователей из списков покупок."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    lock_versions(user_ids)
+    ShopListIngredient.objects.filter(user_id__in=user_ids).delete()
+    ShopListIngredient.objects.bulk_create(
+        ShopListIngredient(
+            user_id=user_id,
+            ingredient_id=ingredient_id,
+            total_amount=total_amount,
+            recipe_count=recipe_count
+        )
+        for (user_id, ingredient_id), (total_amount, recipe_count)
+        in totals(user_ids).items()
+    )
+    bump_versions(user_ids)
+
+
+def repair(batch_size=1000):
+    """Пересчет итогов, разошедшихся со списками покупок, пачками
+    пользователей. Возвращает число исправленных пользователей."""
+    user_ids = sorted(
+        set(ShopList.objects.values_list('user_id', flat=True).distinct())
+        | set(ShopListIngredient.objects.values_list(
+            'user_id', flat=True
+        ).distinct())
+    )
+    repaired = 0
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        expected = totals(batch)
+        actual = {
+            (user_id, ingredient_id): (total_amount, recipe_count)
+            for user_id, ingredient_id, total_amount, recipe_count
+            in ShopListIngredient.objects.filter(
+                user_id__in=batch
+            ).values_list(
+                'user_id', 'ingredient_id', 'total_amount', 'recipe_count'
+            )
+        }
+        broken = {
+            user_id for user_id, ingredient_id in expected.keys() | actual
+            if expected.get((user_id, ingredient_id))
+            != actual.get((user_id, ingredient_id))
+        }
+        rebuild(broken)
+        repaired += len(broken)
+    return repaired
+
+
+def recipes_changed(recipe_ids):
+    """Пересчет итогов всех, у кого рецепты в списке покупок."""
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending.update(recipe_ids)
+        return
+    lock_recipes(recipe_ids)
+    rebuild(
+        ShopList.objects.filter(recipe_id__in=recipe_ids).values_list(
+            'user_id', flat=True
+        ).distinct()
+    )
@@ -0,0 +1,181 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from core import counters
+from core.cache import bump_version
+from core.images import delete_variants, schedule_variants, variants_ready
+from users.models import Follow, User
+from . import fragments, shoplist
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient, RecipeTag,
+                     ShopList, Tag)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    # индекс автодополнения во всех процессах сверяется с этой версией
+    transaction.on_commit(lambda: bump_version('ingredients'))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version('tags'))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete, m2m_changed), sender=RecipeTag)
+@receiver((post_save, post_delete, m2m_changed), sender=RecipeIngredient)
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def recipe_list_changed(sender, **kwargs):
+    # версию меняем после фиксации, иначе параллельный запрос может
+    # закэшировать под новой версией еще старые данные
+    transaction.on_commit(lambda: bump_version('recipes'))
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, update_fields=None, **kwargs):
+    # вход пользователя меняет только last_login
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        transaction.on_commit(lambda: bump_version('recipes'))
+        fragments.bump_author(instance.pk)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_fragment_changed(sender, instance, **kwargs):
+    fragments.bump_recipes([instance.pk])
+
+
+@receiver((post_save, post_delete), sender=RecipeTag)
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_relation_changed(sender, instance, **kwargs):
+    fragments.bump_recipes([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=RecipeTag)
+@receiver(m2m_changed, sender=RecipeIngredient)
+def recipe_relations_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        fragments.bump_recipes([instance.pk])
+    else:
+        # изменение со стороны тэга или ингредиента, в том числе clear()
+        # без списка рецептов, сбрасывает фрагменты всех рецептов
+        namespace = 'tags' if sender is RecipeTag else 'ingredients'
+        transaction.on_commit(lambda: bump_version(namespace))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShopList)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Follow)
+def count_created(sender, instance, created, **kwargs):
+    if created and not counters.is_suspended():
+        counters.related_created(sender, (instance,))
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShopList)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Follow)
+def count_deleted(sender, instance, **kwargs):
+    if not counters.is_suspended():
+        counters.related_deleted(sender, (instance,))
+
+
+def release_image(name):
+    """Удаление копий после фиксации, если изображение больше не
+    используется: у сгенерированных рецептов оно общее."""
+    def release():
+        if not Recipe.objects.filter(image=name).exists():
+            delete_variants(name)
+    if name:
+        transaction.on_commit(release)
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_saving(sender, instance, **kwargs):
+    # загруженный файл получает имя при сохранении, прежнее изображение
+    # узнаем до него
+    instance.replaced_image = None
+    if not instance._state.adding:
+        instance.replaced_image = Recipe.objects.filter(
+            pk=instance.pk
+        ).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, **kwargs):
+    replaced = getattr(instance, 'replaced_image', None)
+    if replaced != instance.image.name:
+        release_image(replaced)
+    schedule_variants(instance.image.name)
+
+
+@receiver(variants_ready)
+def recipe_variants_ready(sender, name, **kwargs):
+    # в кэшированных ответах вместо копий ссылка на исходное изображение
+    fragments.bump_recipes(
+        Recipe.objects.filter(image=name).values_list('pk', flat=True)
+    )
+    transaction.on_commit(lambda: bump_version('recipes'))
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    shoplist.mark_deleting('recipe', instance.pk)
+    instance.shoplist_users = list(
+        instance.shoplists.values_list('user_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    release_image(instance.image.name)
+    shoplist.deleting('recipe').discard(instance.pk)
+    if not shoplist.is_suspended():
+        shoplist.rebuild(
+            set(getattr(instance, 'shoplist_users', ()))
+            - shoplist.deleting('user')
+        )
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    shoplist.mark_deleting('user', instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    shoplist.deleting('user').discard(instance.pk)
+
+
+def shoplist_affected(instance):
+    return not (
+        shoplist.is_suspended()
+        or instance.recipe_id in shoplist.deleting('recipe')
+        or instance.user_id in shoplist.deleting('user')
+    )
+
+
+@receiver(post_save, sender=ShopList)
+def shoplist_added(sender, instance, created, **kwargs):
+    if created and shoplist_affected(instance):
+        shoplist.apply_recipes(instance.user_id, [instance.recipe_id], 1)
+
+
+@receiver(post_delete, sender=ShopList)
+def shoplist_removed(sender, instance, **kwargs):
+    if shoplist_affected(instance):
+        shoplist.apply_recipes(instance.user_id, [instance.recipe_id], -1)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    if not (
+        shoplist.is_suspended()
+        or instance.recipe_id in shoplist.deleting('recipe')
+    ):
+        shoplist.recipes_changed([instance.recipe_id])
@@ -31,6 +31,16 @@ class User(AbstractUser):
     password = models.CharField(
         max_length=FIELD_LENGTH['PASSWORD']
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Кол-во рецептов',
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Кол-во подписчиков',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -5,6 +5,7 @@ from django.core.validators import validate_email
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator, UniqueValidator
 
+from core import images
 from core.constants import FIELD_LENGTH
 from core.validators import username_validator
 from foods.models import Recipe
@@ -28,6 +29,8 @@ class UserSerializers(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return bool(self.context
                     and self.context.get('request').user.is_authenticated
                     and obj.following.filter(
@@ -142,6 +145,12 @@ class FollowSerializer(UserSerializers):
         )
 
     def get_recipes(self, obj):
+        # рецепты уже выбраны в UserViewSet.subscriptions
+        if hasattr(obj, 'limited_recipes'):
+            return RecipeShortSerializer(
+                obj.limited_recipes,
+                many=True
+            ).data
         recipes_limit = 0
         if self.context.get('request'):
             recipes_limit = int(
@@ -157,15 +166,21 @@ class FollowSerializer(UserSerializers):
         ).data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
+    thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
         fields = (
             'id',
             'name',
             'image',
+            'thumbnails',
             'cooking_time',
         )
+
+    def get_thumbnails(self, obj):
+        return images.variant_urls(obj.image)
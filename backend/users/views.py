@@ -1,3 +1,7 @@
+from collections import defaultdict
+
+from django.db.models import BooleanField, Exists, F, OuterRef, Value, Window
+from django.db.models.functions import RowNumber
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet as DjoserViewSet
 from rest_framework import status
@@ -6,6 +10,7 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
 from core.pagination import PageLimitPagination
+from foods.models import Recipe
 from .models import Follow, User
 from .serializers import (FollowCreateSerializer, FollowSerializer,
                           UserCreateSerializers, UserSerializers)
@@ -17,6 +22,17 @@ class UserViewSet(DjoserViewSet):
     http_method_names = ['get', 'post', 'delete']
     pagination_class = PageLimitPagination
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_authenticated and self.action in ('list', 'retrieve'):
+            queryset = queryset.annotate(
+                is_subscribed=Exists(
+                    Follow.objects.filter(user=user, following=OuterRef('pk'))
+                )
+            )
+        return queryset
+
     @action(
         detail=True,
         methods=['post', 'delete']
@@ -50,8 +66,15 @@ class UserViewSet(DjoserViewSet):
         detail=False
     )
     def subscriptions(self, request):
-        users = User.objects.filter(following__user=request.user)
+        users = User.objects.filter(
+            following__user=request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by(*User._meta.ordering)
         page = self.paginate_queryset(users)
+        UserViewSet.attach_recipes(
+            page, int(request.query_params.get('recipes_limit', 0))
+        )
         serializer = FollowSerializer(
             page,
             many=True,
@@ -61,6 +84,35 @@ class UserViewSet(DjoserViewSet):
         )
         return self.get_paginated_response(serializer.data)
 
+    @staticmethod
+    def attach_recipes(authors, recipes_limit):
+        """Рецепты всех авторов страницы одним запросом.
+
+        При ограничении количества берутся первые recipes_limit рецептов
+        каждого автора через ROW_NUMBER() OVER (PARTITION BY author).
+        """
+        recipes = Recipe.objects.filter(author__in=authors)
+        if recipes_limit:
+            ranked = recipes.annotate(
+                recipe_rank=Window(
+                    RowNumber(),
+                    partition_by=F('author'),
+                    order_by=(F('pub_date').desc(), F('name').asc()),
+                )
+            ).order_by()
+            sql, params = ranked.query.sql_with_params()
+            recipes = Recipe.objects.raw(
+                f'SELECT * FROM ({sql}) ranked WHERE recipe_rank <= %s '
+                'ORDER BY author_id, recipe_rank',
+                (*params, recipes_limit)
+            )
+
+        author_recipes = defaultdict(list)
+        for recipe in recipes:
+            author_recipes[recipe.author_id].append(recipe)
+        for author in authors:
+            author.limited_recipes = author_recipes[author.id]
+
     def get_serializer_class(self):
         if self.request.method in ('POST',):
             return UserCreateSerializers